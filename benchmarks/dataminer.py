@@ -0,0 +1,241 @@
+"""End to end benchmark of call_wps and generate_tools.
+
+The console scripts are run against the local stand-in of the D4Science
+services (see standin.py), so the numbers only depend on the code of this
+package and on the latency, job duration and output sizes given here. For
+call_wps, --callers processes run at the same time until --calls executions
+are done; generate_tools is run once with an empty cache and once more with
+the cache already filled:
+
+    python benchmarks/dataminer.py [--calls 20] [--callers 4] [--latency 0.02]
+
+Reported: latency of each run (median and 95th percentile), throughput,
+requests and bytes seen by the stand-in and peak RSS of the scripts.
+"""
+
+from __future__ import print_function
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import standin
+
+# the scripts are run from this source tree even if the package is installed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    "call_wps": "galaxy_dataminer.caller",
+    "generate_tools": "galaxy_dataminer.generator",
+}
+
+TOOL_CONF = """<?xml version="1.0"?>
+<toolbox>
+  <section id="d4science" name="DataMiner"/>
+</toolbox>
+"""
+
+
+def script(name, args):
+    code = "import sys; from %s import main; sys.argv[0] = %r; main()" % (
+        ENTRY_POINTS[name],
+        name,
+    )
+    return [sys.executable, "-c", code] + args
+
+
+def run(cmd, cwd):
+    # (elapsed seconds, exit code, peak RSS in KiB) of cmd
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p]
+    )
+    start = time.time()
+    p = subprocess.Popen(
+        cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    _, status, usage = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    return elapsed, os.waitstatus_to_exitcode(status), usage.ru_maxrss
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+class Counter:
+    # difference of the stand-in counters over a block of runs
+    def __init__(self, server):
+        self.server = server
+
+    def __enter__(self):
+        self.start = dict(self.server.stats)
+        return self
+
+    def __exit__(self, *exc):
+        self.stats = dict(
+            (k, v - self.start.get(k, 0)) for k, v in self.server.stats.items()
+        )
+
+
+def summary(name, runs, wall, counter):
+    times = [r[0] for r in runs]
+    failed = len([r for r in runs if r[1] != 0])
+    return {
+        "name": name,
+        "runs": len(runs),
+        "failed": failed,
+        "median": percentile(times, 0.5),
+        "p95": percentile(times, 0.95),
+        "throughput": len(runs) / wall if wall else 0.0,
+        "peak_rss_kib": max(r[2] for r in runs),
+        "requests": counter.stats.get("requests", 0),
+        "bytes_in": counter.stats.get("bytes_in", 0),
+        "bytes_out": counter.stats.get("bytes_out", 0),
+    }
+
+
+def bench_call_wps(server, args, workdir):
+    data = os.path.join(workdir, "input.csv")
+    # written in blocks: the RSS reported for the scripts includes the one
+    # of this process when they are started
+    with open(data, "w") as f:
+        f.write("a,b,c,d,e,f,g,h\n")
+        block = "1,2,3,4,5,6,7,8\n" * 65536
+        for _ in range(args.input_size // len(block)):
+            f.write(block)
+    counter = [0]
+    lock = threading.Lock()
+
+    def call(_):
+        with lock:
+            counter[0] += 1
+            n = counter[0]
+        calldir = os.path.join(workdir, "call%04d" % n)
+        os.makedirs(calldir)
+        process = server.process(n % server.processes)["identifier"]
+        cmd = script(
+            "call_wps",
+            [
+                "--process",
+                process,
+                "--input",
+                "count=3",
+                "--inputdata",
+                "data=" + data,
+                "--output",
+                os.path.join(calldir, "output.html"),
+                "--outdir",
+                os.path.join(calldir, "outdir"),
+                "--token",
+                "benchmark",
+                "--cache-dir",
+                os.path.join(workdir, "cache"),
+                "--wps-url",
+                server.base + "/wps/WebProcessingService",
+                "--registry-url",
+                server.base + "/registry",
+            ],
+        )
+        return run(cmd, calldir)
+
+    with Counter(server) as c:
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=args.callers) as executor:
+            runs = list(executor.map(call, range(args.calls)))
+        wall = time.time() - start
+    return summary("call_wps x%d" % args.callers, runs, wall, c)
+
+
+def bench_generate_tools(server, args, workdir):
+    conf = os.path.join(workdir, "tool_conf.xml")
+    with open(conf, "w") as f:
+        f.write(TOOL_CONF)
+    token = os.path.join(workdir, "token")
+    with open(token, "w") as f:
+        f.write("benchmark\n")
+    cmd = script(
+        "generate_tools",
+        [
+            "--config",
+            conf,
+            "--token",
+            token,
+            "--outdir",
+            os.path.join(workdir, "tools"),
+            "--wps-url",
+            server.base + "/wps/WebProcessingService",
+        ],
+    )
+    results = []
+    for name in ("generate_tools (cold)", "generate_tools (warm)"):
+        with Counter(server) as c:
+            start = time.time()
+            runs = [run(cmd, workdir)]
+            wall = time.time() - start
+        results.append(summary(name, runs, wall, c))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the console scripts against a local stand-in"
+    )
+    parser.add_argument("--calls", type=int, default=20, help="call_wps executions")
+    parser.add_argument(
+        "--callers", type=int, default=4, help="concurrent call_wps processes"
+    )
+    parser.add_argument(
+        "--input-size", type=int, default=1024 * 1024, help="bytes of the input data"
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    standin.add_arguments(parser)
+    parser.set_defaults(processes=50, latency=0.02, job_duration=1.0)
+    args = parser.parse_args()
+
+    server = standin.serve(standin.from_arguments(args)).standin
+    workdir = tempfile.mkdtemp()
+    try:
+        results = [bench_call_wps(server, args, workdir)]
+        results += bench_generate_tools(server, args, workdir)
+    finally:
+        shutil.rmtree(workdir)
+
+    print(
+        "%-24s %5s %8s %8s %8s %8s %10s %10s %9s"
+        % ("", "runs", "median", "p95", "runs/s", "requests", "sent", "received", "rss")
+    )
+    for r in results:
+        print(
+            "%-24s %5s %7.3fs %7.3fs %8.2f %8d %9.1fM %9.1fM %8.1fM%s"
+            % (
+                r["name"],
+                r["runs"],
+                r["median"],
+                r["p95"],
+                r["throughput"],
+                r["requests"],
+                r["bytes_in"] / 1048576.0,
+                r["bytes_out"] / 1048576.0,
+                r["peak_rss_kib"] / 1024.0,
+                "  (%d failed)" % r["failed"] if r["failed"] else "",
+            )
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if any(r["failed"] for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""Local stand-in for the D4Science services used by the console scripts.
+
+It answers the Information System query for the StorageHub endpoint, the
+StorageHub item, upload and publiclink calls, and the WPS GetCapabilities,
+DescribeProcess, Execute and status requests, with a configurable latency,
+job duration and number/size of the outputs. Requests and bytes moved are
+counted in StandIn.stats. Run it on its own with:
+
+    python benchmarks/standin.py --port 8080
+
+and point call_wps to it with --wps-url http://127.0.0.1:8080/wps/WebProcessingService
+--registry-url http://127.0.0.1:8080/registry
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WPS_NS = (
+    'xmlns:wps="http://www.opengis.net/wps/1.0.0" '
+    'xmlns:ows="http://www.opengis.net/ows/1.1" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink"'
+)
+
+CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<wps:Capabilities %(ns)s service="WPS" version="1.0.0">
+<ows:ServiceIdentification><ows:Title>Stand-in WPS</ows:Title>
+<ows:ServiceType>WPS</ows:ServiceType></ows:ServiceIdentification>
+<wps:ProcessOfferings>%(processes)s</wps:ProcessOfferings>
+</wps:Capabilities>"""
+
+OFFERING = """<wps:Process wps:processVersion="%(version)s">
+<ows:Identifier>%(identifier)s</ows:Identifier><ows:Title>%(title)s</ows:Title>
+</wps:Process>"""
+
+DESCRIPTION = """<?xml version="1.0" encoding="UTF-8"?>
+<wps:ProcessDescriptions %(ns)s service="WPS" version="1.0.0">
+<ProcessDescription wps:processVersion="%(version)s" storeSupported="true"
+ statusSupported="true">
+<ows:Identifier>%(identifier)s</ows:Identifier><ows:Title>%(title)s</ows:Title>
+<ows:Abstract>Stand-in process %(title)s</ows:Abstract>
+<DataInputs>
+<Input minOccurs="0" maxOccurs="1"><ows:Identifier>count</ows:Identifier>
+<ows:Title>A number</ows:Title><LiteralData><ows:DataType ows:reference="xs:int"/>
+<ows:AnyValue/><DefaultValue>1</DefaultValue></LiteralData></Input>
+<Input minOccurs="0" maxOccurs="1"><ows:Identifier>data</ows:Identifier>
+<ows:Title>A table</ows:Title><ComplexData><Default><Format>
+<MimeType>text/csv</MimeType></Format></Default><Supported><Format>
+<MimeType>text/csv</MimeType></Format></Supported></ComplexData></Input>
+</DataInputs>
+<ProcessOutputs><Output><ows:Identifier>non_deterministic_output</ows:Identifier>
+<ows:Title>Output</ows:Title><ComplexOutput><Default><Format>
+<MimeType>text/xml</MimeType></Format></Default><Supported><Format>
+<MimeType>text/xml</MimeType></Format></Supported></ComplexOutput></Output>
+</ProcessOutputs>
+</ProcessDescription></wps:ProcessDescriptions>"""
+
+EXECUTE_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<wps:ExecuteResponse %(ns)s service="WPS" version="1.0.0"
+ statusLocation="%(base)s/wps/status?id=%(job)s">
+<wps:Process wps:processVersion="%(version)s">
+<ows:Identifier>%(identifier)s</ows:Identifier><ows:Title>%(title)s</ows:Title>
+</wps:Process>
+<wps:Status creationTime="2020-01-01T00:00:00Z">%(status)s</wps:Status>
+%(outputs)s
+</wps:ExecuteResponse>"""
+
+OUTPUTS = """<wps:ProcessOutputs><wps:Output>
+<ows:Identifier>non_deterministic_output</ows:Identifier><ows:Title>Output</ows:Title>
+<wps:Reference href="%(base)s/wps/output?id=%(job)s.gml" mimeType="text/xml"/>
+</wps:Output></wps:ProcessOutputs>"""
+
+RESULT = """<ogr:Result fid="F%(index)d">
+<d4science:Data>%(base)s/results/%(job)s/%(index)d</d4science:Data>
+<d4science:Description>%(description)s</d4science:Description>
+<d4science:MimeType>%(mime_type)s</d4science:MimeType>
+</ogr:Result>"""
+
+REGISTRY = """<Resources><Result><Resource><Profile><AccessPoint><RunningInstanceInterfaces>
+<Endpoint EntryName="org.gcube.data.access.storagehub.StorageHub">%s/storagehub</Endpoint>
+</RunningInstanceInterfaces></AccessPoint></Profile></Resource></Result></Resources>"""
+
+
+class StandIn:
+    def __init__(
+        self,
+        processes=3,
+        latency=0.0,
+        job_duration=1.0,
+        outputs=2,
+        output_size=1024 * 1024,
+    ):
+        self.processes = processes
+        self.latency = latency
+        self.job_duration = job_duration
+        self.outputs = outputs
+        self.output_size = output_size
+        self.base = None
+        self.jobs = {}
+        self.items = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0}
+        self.requests = {}
+
+    def process(self, i):
+        return {
+            "identifier": "org.standin.process.P%03d" % i,
+            "title": "Process %03d" % i,
+            "version": "1.1.0",
+        }
+
+    def count(self, kind, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_in"] += bytes_in
+            self.stats["bytes_out"] += bytes_out
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _drain(self):
+        # uploaded files are only counted, not kept in memory
+        length = int(self.headers.get("Content-Length", 0))
+        left = length
+        while left > 0:
+            block = self.rfile.read(min(left, 1024 * 1024))
+            if not block:
+                break
+            left -= len(block)
+        return length - left
+
+    def _send(self, kind, data, content_type="text/xml", status=200, bytes_in=0):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        time.sleep(self.standin.latency)
+        self.standin.count(kind, bytes_in, len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_xml(self, job_id):
+        job = self.standin.jobs[job_id]
+        elapsed = time.time() - job["start"]
+        values = dict(job["process"], ns=WPS_NS, base=self.standin.base, job=job_id)
+        if elapsed >= self.standin.job_duration:
+            values["status"] = "<wps:ProcessSucceeded>Done</wps:ProcessSucceeded>"
+            values["outputs"] = OUTPUTS % values
+        else:
+            percent = int(100 * elapsed / self.standin.job_duration)
+            values["status"] = (
+                '<wps:ProcessStarted percentCompleted="%d">Running'
+                "</wps:ProcessStarted>" % percent
+            )
+            values["outputs"] = ""
+        return EXECUTE_RESPONSE % values
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((k.lower(), v[0]) for k, v in parse_qs(url.query).items())
+        path = url.path
+        if path == "/wps/WebProcessingService":
+            request = query.get("request", "")
+            if request == "GetCapabilities":
+                processes = "".join(
+                    OFFERING % self.standin.process(i)
+                    for i in range(self.standin.processes)
+                )
+                return self._send(
+                    "GetCapabilities",
+                    CAPABILITIES % {"ns": WPS_NS, "processes": processes},
+                )
+            if request == "DescribeProcess":
+                i = int(query["identifier"].rsplit("P", 1)[1])
+                values = dict(self.standin.process(i), ns=WPS_NS)
+                return self._send("DescribeProcess", DESCRIPTION % values)
+        elif path == "/wps/status":
+            return self._send("Status", self._job_xml(query["id"]))
+        elif path == "/wps/output":
+            job_id = query["id"].rsplit(".", 1)[0]
+            values = {"base": self.standin.base, "job": job_id}
+            results = []
+            for i in range(self.standin.outputs):
+                values.update(
+                    index=i, description="Output %d" % i, mime_type="text/csv"
+                )
+                results.append(RESULT % values)
+            values.update(
+                index=self.standin.outputs,
+                description="Log of the computation",
+                mime_type="text/csv",
+            )
+            results.append(RESULT % values)
+            doc = (
+                '<ogr:FeatureCollection xmlns:ogr="http://ogr.maptools.org/" '
+                'xmlns:gml="http://www.opengis.net/gml" '
+                'xmlns:d4science="http://www.d4science.org">'
+                "<gml:featureMember>%s</gml:featureMember>"
+                "</ogr:FeatureCollection>" % "".join(results)
+            )
+            return self._send("Output", doc)
+        elif path.startswith("/results/"):
+            return self._send_result(path)
+        elif path.startswith("/registry"):
+            return self._send("Registry", REGISTRY % self.standin.base)
+        elif path == "/storagehub":
+            return self._send(
+                "StorageHub", json.dumps({"item": {"id": "root"}}), "application/json"
+            )
+        elif re.match(r"^/storagehub/items/[^/]+/children$", path):
+            folders = [
+                {"id": k, "name": v["name"]}
+                for k, v in self.standin.items.items()
+                if v["type"] == "FOLDER"
+            ]
+            return self._send(
+                "StorageHub", json.dumps({"itemlist": folders}), "application/json"
+            )
+        elif re.match(r"^/storagehub/items/[^/]+/publiclink$", path):
+            item_id = path.split("/")[3]
+            return self._send(
+                "StorageHub",
+                '"%s/public/%s"' % (self.standin.base, item_id),
+                "text/plain",
+            )
+        elif path.startswith("/public/"):
+            item = self.standin.items.get(path.split("/")[2])
+            if item:
+                data = b"x" * item["size"]
+                return self._send("Public", data, "application/octet-stream")
+        self._send("NotFound", "not found", "text/plain", 404)
+
+    def do_HEAD(self):
+        # public links are checked before an uploaded file is reused
+        path = urlparse(self.path).path
+        exists = (
+            path.startswith("/public/") and path.split("/")[2] in self.standin.items
+        )
+        time.sleep(self.standin.latency)
+        self.standin.count("Public")
+        self.send_response(200 if exists else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _send_result(self, path):
+        size = self.standin.output_size
+        chunk = b"x" * 65536
+        start = 0
+        status = 200
+        rng = self.headers.get("Range")
+        if rng:
+            start = int(rng.split("=")[1].split("-")[0])
+            status = 206
+        length = max(0, size - start)
+        time.sleep(self.standin.latency)
+        self.standin.count("Result", 0, length)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(length))
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes %d-%d/%d" % (start, size - 1, size)
+            )
+        self.end_headers()
+        while length > 0:
+            block = chunk[: min(length, len(chunk))]
+            self.wfile.write(block)
+            length -= len(block)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        m = re.match(r"^/storagehub/items/([^/]+)/create/FILE$", path)
+        if m:
+            item_id = str(uuid.uuid4())
+            size = self._drain()
+            self.standin.items[item_id] = {"type": "FILE", "name": "", "size": size}
+            return self._send("StorageHub", item_id, "text/plain", bytes_in=size)
+        body = self._body()
+        if path == "/wps/WebProcessingService":
+            identifier = re.search(rb"Identifier[^>]*>([^<]+)<", body)
+            i = int(identifier.group(1).decode().rsplit("P", 1)[1])
+            job_id = str(uuid.uuid4())
+            self.standin.jobs[job_id] = {
+                "start": time.time(),
+                "process": self.standin.process(i),
+            }
+            return self._send("Execute", self._job_xml(job_id), bytes_in=len(body))
+        m = re.match(r"^/storagehub/items/([^/]+)/create/FOLDER$", path)
+        if m:
+            item_id = str(uuid.uuid4())
+            name = parse_qs(body.decode()).get("name", [""])[0]
+            self.standin.items[item_id] = {"type": "FOLDER", "name": name}
+            return self._send("StorageHub", item_id, "text/plain", bytes_in=len(body))
+        self._send("NotFound", "not found", "text/plain", 404)
+
+
+def serve(standin, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.standin = standin
+    standin.base = "http://%s:%d" % server.server_address
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--processes", type=int, default=3, help="processes offered by the WPS"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each response"
+    )
+    parser.add_argument(
+        "--job-duration", type=float, default=1.0, help="seconds each execution takes"
+    )
+    parser.add_argument(
+        "--outputs", type=int, default=2, help="results of each execution"
+    )
+    parser.add_argument(
+        "--output-size", type=int, default=1024 * 1024, help="bytes of each result"
+    )
+
+
+def from_arguments(args):
+    return StandIn(
+        processes=args.processes,
+        latency=args.latency,
+        job_duration=args.job_duration,
+        outputs=args.outputs,
+        output_size=args.output_size,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="D4Science services stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(from_arguments(args), args.host, args.port)
+    print("WPS: %s/wps/WebProcessingService" % server.standin.base)
+    print("Registry: %s/registry" % server.standin.base)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
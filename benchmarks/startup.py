@@ -0,0 +1,138 @@
+"""Start up time of the console scripts.
+
+Every Galaxy job pays the start up of one of these scripts, so their import
+cost is kept under a budget. Each command is run several times and the
+median time over a bare interpreter start is compared with its threshold,
+the exit code is non-zero if any of them is over budget:
+
+    python benchmarks/startup.py [--repeat 10] [--threshold "call_wps --help=0.2"]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# seconds over a bare "python -c pass"
+THRESHOLDS = {
+    "call_wps --help": 0.10,
+    "wps_extract": 0.05,
+    "generate_tools --help": 0.15,
+    "call_wps_batch --help": 0.10,
+}
+
+ENTRY_POINTS = {
+    "call_wps": "galaxy_dataminer.caller",
+    "wps_extract": "galaxy_dataminer.extract",
+    "generate_tools": "galaxy_dataminer.generator",
+    "call_wps_batch": "galaxy_dataminer.batch",
+}
+
+EXTRACT_HTML = (
+    '<html><body><script type="application/json" id="dataminer-output">'
+    '{"outputs": [{"name": "out.csv", "mime_type": "text/csv", '
+    '"descriptor": "Output"}]}</script></body></html>'
+)
+
+
+def script(name, args):
+    # same as the console script generated for the entry point
+    code = "import sys; from %s import main; sys.argv[0] = %r; main()" % (
+        ENTRY_POINTS[name],
+        name,
+    )
+    return [sys.executable, "-c", code] + args
+
+
+def commands(workdir):
+    html = os.path.join(workdir, "input.html")
+    with open(html, "w") as f:
+        f.write(EXTRACT_HTML)
+    inputdir = os.path.join(workdir, "input_files")
+    os.makedirs(inputdir)
+    with open(os.path.join(inputdir, "out.csv"), "w") as f:
+        f.write("a,b\n1,2\n")
+    extract_args = [
+        "--inputdata",
+        html,
+        "--inputdir",
+        inputdir,
+        "--descriptor",
+        "Output",
+        "--output",
+        os.path.join(workdir, "extracted.csv"),
+    ]
+    return {
+        "call_wps --help": script("call_wps", ["--help"]),
+        "wps_extract": script("wps_extract", extract_args),
+        "generate_tools --help": script("generate_tools", ["--help"]),
+        "call_wps_batch --help": script("call_wps_batch", ["--help"]),
+    }
+
+
+def timeit(cmd, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+        times.append(time.time() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure console script start up")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per command")
+    parser.add_argument(
+        "--threshold",
+        action="append",
+        default=[],
+        help="override a budget, as NAME=SECONDS",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    thresholds = dict(THRESHOLDS)
+    for t in args.threshold:
+        name, value = t.rsplit("=", 1)
+        thresholds[name] = float(value)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        baseline = timeit([sys.executable, "-c", "pass"], args.repeat)
+        print("%-24s %8.3fs" % ("python (baseline)", baseline))
+        results = {"baseline": baseline, "commands": {}}
+        failed = []
+        for name, cmd in sorted(commands(workdir).items()):
+            elapsed = timeit(cmd, args.repeat)
+            overhead = elapsed - baseline
+            over = overhead > thresholds[name]
+            if over:
+                failed.append(name)
+            results["commands"][name] = {
+                "median": elapsed,
+                "overhead": overhead,
+                "threshold": thresholds[name],
+            }
+            print(
+                "%-24s %8.3fs  %+.3fs (budget %.3fs)%s"
+                % (name, elapsed, overhead, thresholds[name], "  OVER" if over else "")
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import time
+
+from galaxy_dataminer.metrics import Metrics
+from galaxy_dataminer.poller import Backoff
+
+DEFAULT_CONCURRENCY = 20
+# status requests started per second, for all the tracked executions
+DEFAULT_RATE = 20.0
+# consecutive failed status requests before giving up on an execution
+MAX_POLL_ERRORS = 5
+# seconds between the lines telling waiting clients the agent is alive, they
+# give up on it after missing a few
+HEARTBEAT = 30.0
+MISSED_HEARTBEATS = 3
+
+
+class Agent:
+    # tracks the executions handed over by call_wps in a single event loop.
+    # Status documents are fetched by a pool of threads sharing one Session,
+    # so connections to DataMiner are reused across executions, and requests
+    # are spaced to stay under rate per second. Clients handing over the
+    # same status location share its polling
+    def __init__(self, session, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE):
+        self.session = session
+        self.rate = rate
+        self.completed = 0
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._tracked = {}
+        self._clients = {}
+        self._next_slot = 0.0
+
+    async def _throttle(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        start = max(now, self._next_slot)
+        self._next_slot = start + 1.0 / self.rate
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _poll(self, execution, url, headers):
+        r = self.session.get(url, headers=headers)
+        r.raise_for_status()
+        execution.checkStatus(response=r.content, sleepSecs=0)
+
+    async def _track(self, url, request):
+        from owslib.wps import WPSExecution
+
+        poll = request.get("poll", {})
+        backoff = Backoff(poll["initial"], poll["factor"], poll["maximum"])
+        execution = WPSExecution()
+        execution.status = request.get("status", "ProcessAccepted")
+        loop = asyncio.get_event_loop()
+        metrics = Metrics()
+        start = time.time()
+        queued = None
+        polls = errors = 0
+        while execution.isComplete() is False:
+            if queued is None and execution.status != "ProcessAccepted":
+                queued = time.time() - start
+            await asyncio.sleep(
+                backoff.next(time.time() - start, execution.percentCompleted)
+            )
+            await self._throttle()
+            try:
+                await loop.run_in_executor(
+                    self._executor, self._poll, execution, url, request.get("headers")
+                )
+            except Exception as e:
+                errors += 1
+                if errors >= MAX_POLL_ERRORS:
+                    raise
+                logging.warning("Cannot check the status of %s: %s", url, e)
+                continue
+            errors = 0
+            polls += 1
+        elapsed = time.time() - start
+        if queued is None:
+            queued = elapsed
+        metrics.add_time("queued", queued)
+        metrics.add_time("running", elapsed - queued)
+        metrics.incr("polls", polls)
+        self.completed += 1
+        logging.info(
+            "%s finished with %s after %d status polls, %d executions tracked",
+            url,
+            execution.status,
+            polls,
+            len(self._tracked) - 1,
+        )
+        return {
+            "status": execution.status,
+            "response": execution.response.decode("utf-8"),
+            "metrics": metrics.to_dict(),
+        }
+
+    def _forget(self, url, task):
+        if self._tracked.get(url) is task:
+            del self._tracked[url]
+
+    async def handle(self, reader, writer):
+        # one JSON line with the execution, answered with a JSON line when it
+        # completes. The polling stops if all its clients disconnect
+        try:
+            request = json.loads((await reader.readline()).decode("utf-8"))
+            url = request["status_location"]
+        except (ValueError, KeyError) as e:
+            reply = {"error": "Bad request: %s" % e}
+            writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+            writer.close()
+            return
+        task = self._tracked.get(url)
+        if task is None:
+            logging.info("Tracking %s", url)
+            task = asyncio.ensure_future(self._track(url, request))
+            task.add_done_callback(lambda t: self._forget(url, t))
+            self._tracked[url] = task
+        self._clients[url] = self._clients.get(url, 0) + 1
+        gone = asyncio.ensure_future(reader.read())
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    [task, gone], timeout=HEARTBEAT, return_when=asyncio.FIRST_COMPLETED
+                )
+                if done:
+                    break
+                writer.write(b'{"heartbeat": true}\n')
+        finally:
+            gone.cancel()
+            self._clients[url] -= 1
+            if not self._clients[url]:
+                del self._clients[url]
+                if not task.done():
+                    logging.info("No clients left for %s, stop tracking", url)
+                    task.cancel()
+        if not task.done():
+            writer.close()
+            return
+        if task.cancelled():
+            reply = {"error": "Agent is shutting down"}
+        elif task.exception():
+            reply = {"error": str(task.exception())}
+        else:
+            reply = task.result()
+        writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    def shutdown(self):
+        # clients are told to poll by themselves
+        for task in list(self._tracked.values()):
+            task.cancel()
+        self._executor.shutdown(wait=False)
+
+
+def remove_stale_socket(path):
+    # a socket file nobody listens on is left behind by an agent that died
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        os.unlink(path)
+    else:
+        raise Exception("An agent is already listening on %s" % path)
+    finally:
+        sock.close()
+
+
+def serve(agent, path):
+    remove_stale_socket(path)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # requests carry the tokens of the users, the socket is never accessible
+    # to others, not even between its creation and a chmod
+    umask = os.umask(0o177)
+    try:
+        server = loop.run_until_complete(asyncio.start_unix_server(agent.handle, path))
+    finally:
+        os.umask(umask)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+    logging.info("Listening on %s", path)
+    try:
+        loop.run_forever()
+    finally:
+        logging.info("Stopping, %d executions completed", agent.completed)
+        server.close()
+        agent.shutdown()
+        # let the handlers tell their clients
+        pending = asyncio.all_tasks(loop)
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        agent.session.log_stats()
+        loop.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def wait_execution(path, execution, headers, backoff, metrics=None):
+    # hands the status polling of execution to the agent listening on path
+    # and blocks until it completes. Returns False if the agent could not
+    # follow it to the end, the caller then polls by itself
+    metrics = metrics or Metrics()
+    if execution.isComplete():
+        return True
+    # the token header is read as bytes
+    headers = dict(
+        (k, v.decode("utf-8") if isinstance(v, bytes) else v)
+        for k, v in (headers or {}).items()
+    )
+    request = {
+        "status_location": execution.statusLocation,
+        "status": execution.status,
+        "headers": headers,
+        "poll": {
+            "initial": backoff.initial,
+            "factor": backoff.factor,
+            "maximum": backoff.maximum,
+        },
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(sock):
+        try:
+            # an agent that is stuck stops sending heartbeats
+            sock.settimeout(HEARTBEAT * MISSED_HEARTBEATS)
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            logging.info("Execution handed over to the agent at %s", path)
+            reader = sock.makefile("rb")
+            while True:
+                line = reader.readline()
+                if line.strip() != b'{"heartbeat": true}':
+                    break
+        except socket.error as e:
+            logging.warning("Cannot use the agent at %s: %s", path, e)
+            return False
+    if not line:
+        logging.warning("Agent at %s went away", path)
+        return False
+    try:
+        reply = json.loads(line.decode("utf-8"))
+        if "error" in reply:
+            logging.warning("Agent at %s failed: %s", path, reply["error"])
+            return False
+        response = reply["response"].encode("utf-8")
+        timings = reply["metrics"]["timings"]
+        counters = reply["metrics"]["counters"]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning("Unexpected answer from the agent at %s: %r", path, e)
+        return False
+    execution.checkStatus(response=response, sleepSecs=0)
+    for name, t in timings.items():
+        metrics.add_time(name, t["seconds"])
+    for name, value in counters.items():
+        metrics.incr(name, value)
+    return True
+
+
+def main():
+    from galaxy_dataminer.session import build_session
+
+    parser = argparse.ArgumentParser(
+        description="Poll the status of the DataMiner executions of all the "
+        "call_wps processes started with --agent-socket"
+    )
+    parser.add_argument("--socket", required=True, help="Unix socket to listen on")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="maximum number of status requests in flight",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help="maximum number of status requests started per second",
+    )
+    parser.add_argument(
+        "--http-timeout", type=float, help="default HTTP timeout in seconds"
+    )
+    parser.add_argument(
+        "--http-retries",
+        type=int,
+        default=3,
+        help="times a failed status request is retried",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("owslib").setLevel(logging.WARNING)
+
+    session = build_session(
+        args.concurrency, args.http_timeout, retries=args.http_retries
+    )
+    serve(Agent(session, args.concurrency, args.rate), args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+from __future__ import print_function
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import os.path
+import sys
+import threading
+
+from galaxy_dataminer import caller, context
+from galaxy_dataminer.metrics import Metrics
+
+# fields of each manifest line, same meaning as the call_wps options
+JOB_FIELDS = ("process", "input", "inputdata", "output", "outdir", "user", "token")
+
+
+class JobFilter(logging.Filter):
+    # only let through records of the job, also those logged by the worker
+    # threads of its uploads and downloads
+    def __init__(self, job):
+        super(JobFilter, self).__init__()
+        self.job = job
+
+    def filter(self, record):
+        return context.job.get() == self.job
+
+
+class Batch:
+    def __init__(self, args):
+        from galaxy_dataminer.session import build_session
+
+        self.args = args
+        # enough pooled connections for all the jobs transferring files
+        pool_size = max(
+            args.http_pool_size, args.jobs * max(args.upload_jobs, args.download_jobs)
+        )
+        self.session = build_session(
+            pool_size, args.http_timeout, args.http_host, **caller.http_options(args)
+        )
+        self._lock = threading.Lock()
+        self._storage = {}
+        self._tokens = {}
+        self._clients = {}
+        self._processes = {}
+        self._process_locks = {}
+
+    def token(self, args):
+        key = (args.user, args.token)
+        with self._lock:
+            if key not in self._tokens:
+                self._tokens[key] = caller.read_token(args)
+            return self._tokens[key]
+
+    def client(self, gcube_token):
+        # one WPS client per token, all of them on the same HTTP session
+        from galaxy_dataminer.session import SessionWPS
+
+        with self._lock:
+            if gcube_token not in self._clients:
+                self._clients[gcube_token] = SessionWPS(
+                    self.args.wps_url,
+                    self.session,
+                    headers={"gcube-token": gcube_token},
+                    skip_caps=True,
+                )
+            return self._clients[gcube_token]
+
+    def describe(self, wps, process_id):
+        with self._lock:
+            lock = self._process_locks.setdefault(process_id, threading.Lock())
+        with lock:
+            if process_id not in self._processes:
+                self._processes[process_id] = wps.describeprocess(process_id)
+            return self._processes[process_id]
+
+    def storage_hub(self, gcube_token, args, metrics=None):
+        # each job gets its own StorageHub (uploads are named after its
+        # call_id), but endpoint and folder discovery is done once per token
+        sh = caller.storage_hub(
+            gcube_token, self.session, args.cache_dir, args.registry_url, metrics
+        )
+        if not args.inputdata:
+            return sh
+        with self._lock:
+            if gcube_token not in self._storage:
+                self._storage[gcube_token] = caller.storage_hub(
+                    gcube_token, self.session, args.cache_dir, args.registry_url
+                )
+            shared = self._storage[gcube_token]
+        shared.create_galaxy_folder()
+        # jobs with the same dataset upload it once
+        sh.upload_index = shared.upload_index
+        sh._uploads = shared._uploads
+        sh._uploads_lock = shared._uploads_lock
+        sh.workspace_url = shared.workspace_url
+        sh.folder_id = shared.folder_id
+        # lets the upload discover them again if they turn out to be wrong
+        sh._from_cache = True
+        return sh
+
+    def job_args(self, spec):
+        args = argparse.Namespace(**vars(self.args))
+        for field in JOB_FIELDS:
+            value = spec.get(field, getattr(self.args, field, None))
+            if field in ("input", "inputdata") and isinstance(value, str):
+                value = [value]
+            setattr(args, field, value)
+        return args
+
+    def run_job(self, spec):
+        args = self.job_args(spec)
+        if not os.path.exists(args.outdir):
+            os.makedirs(args.outdir)
+        handler = logging.FileHandler(os.path.join(args.outdir, caller.LOGFILE))
+        # same format as the logfile of call_wps
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        handler.addFilter(JobFilter(args.outdir))
+        logging.getLogger("").addHandler(handler)
+        job = context.job.set(args.outdir)
+        # HTTP requests are not counted, the session is shared by all jobs
+        metrics = Metrics(process=args.process)
+        try:
+            logging.debug("Job: %s", json.dumps(spec, sort_keys=True))
+            with metrics.span("token"):
+                gcube_vre_token = self.token(args)
+            if gcube_vre_token is None:
+                raise Exception("No user id found on the call")
+            wps = self.client(gcube_vre_token)
+            with metrics.span("describe_process"):
+                process = self.describe(wps, args.process)
+            sh = self.storage_hub(gcube_vre_token, args, metrics)
+            return caller.execute_process(wps, process, args, sh, self.session, metrics)
+        except Exception:
+            logging.exception("Error on wps execution!")
+            return 1
+        finally:
+            caller.write_metrics(metrics, args)
+            context.job.reset(job)
+            logging.getLogger("").removeHandler(handler)
+            handler.close()
+
+    def run(self, specs):
+        with ThreadPoolExecutor(max_workers=max(1, self.args.jobs)) as executor:
+            exit_codes = list(executor.map(self.run_job, specs))
+        self.session.log_stats()
+        return exit_codes
+
+
+def read_manifest(path):
+    specs = []
+    with open(path, "r") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            spec = json.loads(line)
+            for field in ("process", "outdir"):
+                if not spec.get(field):
+                    raise Exception("%s:%d: missing %s" % (path, n, field))
+            specs.append(spec)
+    return specs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Call several DataMiner processes described in a manifest"
+    )
+    parser.add_argument(
+        "--manifest", required=True, help="JSON lines file with one job per line"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=8, help="number of jobs to run concurrently"
+    )
+    parser.add_argument("--user", help="default user for the jobs")
+    parser.add_argument("--token", help="default gcube-token for the jobs")
+    caller.add_execution_arguments(parser)
+
+    args = parser.parse_args()
+
+    logging.getLogger("").setLevel(logging.DEBUG)
+    log_error = logging.StreamHandler(sys.stderr)
+    log_error.setLevel(logging.ERROR)
+    logging.getLogger("").addHandler(log_error)
+
+    specs = read_manifest(args.manifest)
+    exit_codes = Batch(args).run(specs)
+    for spec, exit_code in zip(specs, exit_codes):
+        print(json.dumps({"outdir": spec.get("outdir"), "exit_code": exit_code}))
+    failed = len([c for c in exit_codes if c != 0])
+    if failed:
+        logging.error("%d of %d jobs failed", failed, len(specs))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+RESULT_FILE = "result.json"
+LOCK_SUFFIX = ".lock"
+
+
+def default_cache_dir():
+    if os.environ.get("GALAXY_DATAMINER_CACHE"):
+        return os.environ["GALAXY_DATAMINER_CACHE"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "galaxy-dataminer")
+
+
+def token_key(token):
+    # never store tokens in clear in the cache files
+    if not isinstance(token, bytes):
+        token = token.encode("utf-8")
+    return hashlib.sha256(token.strip()).hexdigest()
+
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    # remembered per (path, size, mtime) so a dataset is read only once even
+    # if several parts of a run need its hash
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    with _digests_lock:
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def safe_name(name):
+    # keep identifiers readable but usable as file names
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+
+@contextlib.contextmanager
+def atomic_file(path):
+    # binary file object writing to a temporary file in the same directory,
+    # renamed to path when the block ends without errors, so readers never
+    # see a half-written file
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_atomic(path, data):
+    with atomic_file(path) as f:
+        f.write(data)
+
+
+def write_if_changed(path, data):
+    # returns True if the file was (re)written
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            current = hashlib.sha256(f.read()).digest()
+        if current == hashlib.sha256(data).digest():
+            return False
+    write_atomic(path, data)
+    return True
+
+
+class DescribeProcessCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "describeprocess")
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, identifier, version):
+        name = "%s@%s.xml" % (safe_name(identifier), safe_name(version or ""))
+        return os.path.join(self.cache_dir, name)
+
+    def get(self, identifier, version):
+        try:
+            with open(self._path(identifier, version), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def put(self, identifier, version, xml):
+        path = self._path(identifier, version)
+        # drop responses of older versions of the process
+        pattern = "%s@*.xml" % glob.escape(safe_name(identifier))
+        for old in glob.glob(os.path.join(self.cache_dir, pattern)):
+            if old != path:
+                os.unlink(old)
+        write_atomic(path, xml)
+
+
+class TTLCache:
+    # small JSON key/value store shared across invocations, entries older
+    # than ttl seconds are ignored and dropped on the next write
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _store(self, data):
+        # a cache that cannot be written is not an error, just a slower run
+        try:
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            write_atomic(self.path, json.dumps(data).encode("utf-8"))
+        except (IOError, OSError) as e:
+            logging.warning("Cannot write cache %s: %s", self.path, e)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # the file is updated by concurrent call_wps processes too, each one
+        # reads, changes and writes it holding a lock on a file next to it
+        import fcntl
+
+        with self._lock:
+            try:
+                dirname = os.path.dirname(os.path.abspath(self.path))
+                if not os.path.exists(dirname):
+                    os.makedirs(dirname)
+                lock_file = open(self.path + LOCK_SUFFIX, "a")
+            except (IOError, OSError) as e:
+                logging.warning("Cannot lock cache %s: %s", self.path, e)
+                yield
+                return
+            with lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def _fresh(self, entry, now):
+        return now - entry.get("time", 0) < self.ttl
+
+    def get(self, key):
+        entry = self._load().get(key)
+        if entry and self._fresh(entry, time.time()):
+            return entry["value"]
+        return None
+
+    def set(self, key, value):
+        with self._locked():
+            now = time.time()
+            data = dict((k, v) for k, v in self._load().items() if self._fresh(v, now))
+            data[key] = {"time": now, "value": value}
+            self._store(data)
+
+    def invalidate(self, key):
+        with self._locked():
+            data = self._load()
+            if data.pop(key, None) is not None:
+                self._store(data)
+
+
+class ResultCache:
+    # outputs of successful executions, one directory per key with the
+    # output files and result.json. Entries are dropped when older than
+    # max_age seconds, then the least recently used ones until the cache
+    # takes less than max_size bytes
+    def __init__(self, cache_dir, max_size, max_age):
+        self.cache_dir = os.path.join(cache_dir, "results")
+        self.max_size = max_size
+        self.max_age = max_age
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _load(self, path):
+        try:
+            with open(os.path.join(path, RESULT_FILE), "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def get(self, key):
+        # returns (directory with the files, stored result) or None
+        path = self._path(key)
+        result = self._load(path)
+        if result is None or time.time() - result["created"] > self.max_age:
+            return None
+        try:
+            # last use, for the eviction
+            os.utime(os.path.join(path, RESULT_FILE), None)
+        except OSError:
+            pass
+        return path, result["result"]
+
+    def put(self, key, result, files):
+        # stores the result (any JSON value) and the files, by base name
+        from galaxy_dataminer.extract import copy_output
+
+        path = self._path(key)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for f in files:
+                # never hard linked, the outdir files are Galaxy datasets
+                copy_output(f, os.path.join(tmp_path, os.path.basename(f)))
+            data = {"created": time.time(), "result": result}
+            write_atomic(
+                os.path.join(tmp_path, RESULT_FILE),
+                json.dumps(data).encode("utf-8"),
+            )
+            if os.path.exists(path):
+                # expired or stored concurrently by another call
+                shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logging.warning("Cannot store result %s: %s", key, e)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.prune()
+
+    def prune(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if name.startswith(".tmp-"):
+                    # left behind by an interrupted put
+                    if now - os.path.getmtime(path) > self.max_age:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                used = os.path.getmtime(os.path.join(path, RESULT_FILE))
+                size = sum(
+                    os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+                )
+            except OSError:
+                continue
+            result = self._load(path)
+            if result is None or now - result["created"] > self.max_age:
+                logging.debug("Removing expired result %s", name)
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((used, size, path))
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logging.debug("Removing result %s to make room", path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
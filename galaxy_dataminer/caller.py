@@ -1,6 +1,7 @@
 from __future__ import print_function
 
 import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
 import hashlib
 from html.parser import HTMLParser
 import json
@@ -9,37 +10,104 @@ import mimetypes
 import os
 import os.path
 import sys
+import threading
+import time
 import uuid
 
-from lxml import etree
-import magic
-from owslib.wps import WebProcessingService, ComplexDataInput, monitorExecution
-import requests
 import six.moves.urllib.parse as urlparse
-from six import StringIO
 
-from galaxy import util
-
-from galaxy_dataminer.caller_parser import CallerHTMLParser
+# galaxy.util, owslib, lxml, magic and requests take a good share of the
+# start up time of every Galaxy job, they are imported only in the code
+# paths that use them
+
+from galaxy_dataminer.cache import (
+    default_cache_dir,
+    file_sha256,
+    ResultCache,
+    token_key,
+    TTLCache,
+)
+from galaxy_dataminer.caller_parser import read_dataminer_data, sniff_html
+from galaxy_dataminer.context import submit
+from galaxy_dataminer.manifest import find_output, galaxy_manifest, write_manifest
+from galaxy_dataminer.metrics import FORMATS, Metrics
+from galaxy_dataminer.poller import Backoff, monitor_execution
 
 LOGFILE = "logfile.log"
+DISCOVERY_CACHE = "storagehub.json"
+DISCOVERY_TTL = 24 * 3600
+UPLOAD_INDEX = "uploads.json"
+UPLOAD_TTL = 7 * 24 * 3600
+UPLOAD_ATTEMPTS = 3
+UPLOAD_RETRY_DELAY = 2.0
+METRICS_FILE = "metrics.json"
+PROFILE_FILE = "profile.pstats"
+DATAMINER_URL = "http://dataminer-prototypes.d4science.org/wps/WebProcessingService"
+REGISTRY_URL = (
+    "http://registry.d4science.org/icproxy/gcube/service/"
+    "GCoreEndpoint/DataAccess/StorageHub"
+)
 
 
 class StorageHub:
-    def __init__(self, gcube_token):
+    def __init__(self, gcube_token, cache=None, session=None, upload_index=None):
+        from galaxy_dataminer.session import build_session
+
         self.gcube_token = gcube_token
+        self.session = session or build_session()
+        self.registry_url = REGISTRY_URL
         self.workspace_url = None
+        self.folder_id = None
         self.galaxy_folder_name = "Galaxy-DataMiner"
         self.call_id = str(uuid.uuid4())
+        # cache is a TTLCache shared across invocations, entries are per token
+        self.cache = cache
+        self._token_key = token_key(gcube_token)
+        self._from_cache = False
+        # maps content hashes of uploaded files to their public links
+        self.upload_index = upload_index
+        # index entries used by this call
+        self._reused = []
+        # index key -> Future of the upload in progress, shared by the
+        # StorageHubs of a batch so a dataset is uploaded once
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+        self._folder_lock = threading.Lock()
+        self.metrics = Metrics()
+        # set to abort the uploads in progress
+        self.cancelled = threading.Event()
+
+    def _cache_get(self, what):
+        if not self.cache:
+            return None
+        value = self.cache.get("%s:%s" % (what, self._token_key))
+        if value:
+            self._from_cache = True
+        return value
+
+    def _cache_set(self, what, value):
+        if self.cache:
+            self.cache.set("%s:%s" % (what, self._token_key), value)
+
+    def invalidate_cache(self):
+        self.workspace_url = None
+        self.folder_id = None
+        self._from_cache = False
+        if self.cache:
+            self.cache.invalidate("endpoint:%s" % self._token_key)
+            self.cache.invalidate("folder:%s" % self._token_key)
 
     def get_base_url(self):
         if self.workspace_url:
             return self.workspace_url
-        url = (
-            "http://registry.d4science.org/icproxy/gcube/service/"
-            "GCoreEndpoint/DataAccess/StorageHub"
+        self.workspace_url = self._cache_get("endpoint")
+        if self.workspace_url:
+            return self.workspace_url
+        from lxml import etree
+
+        r = self.session.get(
+            self.registry_url, params={"gcube-token": self.gcube_token}
         )
-        r = requests.get(url, params={"gcube-token": self.gcube_token})
         r.raise_for_status()
         root = etree.fromstring(r.text)
         endpoints = root.findall(
@@ -48,16 +116,27 @@ class StorageHub:
         for child in endpoints:
             entry_name = child.attrib["EntryName"]
             if entry_name == "org.gcube.data.access.storagehub.StorageHub":
-                return child.text
+                self.workspace_url = child.text
+                self._cache_set("endpoint", self.workspace_url)
+                return self.workspace_url
         return None
 
     def create_galaxy_folder(self):
+        with self._folder_lock, self.metrics.span("storagehub_discovery"):
+            self._create_galaxy_folder()
+
+    def _create_galaxy_folder(self):
+        if self.folder_id:
+            return
+        self.folder_id = self._cache_get("folder")
+        if self.folder_id:
+            return
         base_url = self.get_base_url()
         # 1. Get id of root folder
-        r = requests.get(base_url, params={"gcube-token": self.gcube_token})
+        r = self.session.get(base_url, params={"gcube-token": self.gcube_token})
         root_id = r.json()["item"]["id"]
         # 2. Find the Galaxy-DataMiner folder
-        r = requests.get(
+        r = self.session.get(
             base_url + "/items/%s/children" % root_id,
             params={"gcube-token": self.gcube_token},
         )
@@ -67,7 +146,7 @@ class StorageHub:
                 break
         else:
             # folder was not there, create it
-            r = requests.post(
+            r = self.session.post(
                 base_url + "/items/%s/create/FOLDER" % root_id,
                 params={"gcube-token": self.gcube_token},
                 data={
@@ -80,31 +159,216 @@ class StorageHub:
                 self.folder_id = r.text
             else:
                 raise Exception("Cannot create Galaxy folder")
+        self._cache_set("folder", self.folder_id)
 
     def upload_file(self, input_name, fname):
+        if not self.upload_index:
+            return self._upload_indexed(input_name, fname, None)
+        index_key = "%s:%s" % (self._token_key, file_sha256(fname))
+        with self._uploads_lock:
+            upload = self._uploads.get(index_key)
+            first = upload is None
+            if first:
+                upload = self._uploads[index_key] = Future()
+        if not first:
+            try:
+                link = upload.result()
+            except Exception:
+                # try it on our own
+                return self._upload_indexed(input_name, fname, index_key)
+            logging.info("%s uploaded by another job, reusing %s", fname, link)
+            self.metrics.incr("uploads.reused")
+            self._reused.append(index_key)
+            return link
+        try:
+            link = self._upload_indexed(input_name, fname, index_key)
+        except BaseException as e:
+            upload.set_exception(e)
+            raise
+        else:
+            upload.set_result(link)
+        finally:
+            # later uploads find it in the index
+            with self._uploads_lock:
+                del self._uploads[index_key]
+        return link
+
+    def _upload_indexed(self, input_name, fname, index_key):
+        import requests
+
+        if index_key:
+            link = self.upload_index.get(index_key)
+            if link and self.link_alive(link):
+                logging.info("%s already uploaded, reusing %s", fname, link)
+                self.metrics.incr("uploads.reused")
+                self._reused.append(index_key)
+                return link
+            if link:
+                logging.info("%s of %s is gone, uploading it again", link, fname)
+                self.upload_index.invalidate(index_key)
+        try:
+            link = self._upload_file(input_name, fname)
+        except requests.exceptions.RequestException as e:
+            if not self._from_cache:
+                raise
+            # cached endpoint or folder may be gone, discover them again
+            logging.warning("Upload with cached StorageHub data failed: %s", e)
+            self.invalidate_cache()
+            link = self._upload_file(input_name, fname)
+        self.metrics.incr("uploads")
+        self.metrics.incr("bytes.uploaded", os.path.getsize(fname))
+        if index_key:
+            self.upload_index.set(index_key, link)
+        return link
+
+    def link_alive(self, link):
+        # the file may have been removed from the folder or the link revoked.
+        # Servers that do not answer HEAD requests are trusted
+        import requests
+
+        try:
+            r = self.session.head(link, allow_redirects=True)
+        except requests.exceptions.RequestException as e:
+            logging.debug("Cannot check %s: %s", link, e)
+            return False
+        r.close()
+        return r.status_code < 400 or r.status_code in (405, 501)
+
+    def forget_reused(self):
+        # after a failed execution, in case it was because of a reused link:
+        # the next call uploads those files again
+        for index_key in self._reused:
+            self.upload_index.invalidate(index_key)
+
+    def _upload_file(self, input_name, fname):
+        self.create_galaxy_folder()
         base_url = self.get_base_url()
-        files = {
-            "name": StringIO("%s-%s" % (input_name, self.call_id)),
-            "file": open(fname, "rb"),
-            "description": StringIO("Input %s for DataMiner execution" % input_name),
-        }
-        r = requests.post(
-            base_url + "/items/%s/create/FILE" % self.folder_id,
-            params={"gcube-token": self.gcube_token},
-            files=files,
-        )
-        r.raise_for_status()
-        file_id = r.text
-        r = requests.get(
-            base_url + "/items/%s/publiclink" % file_id,
-            params={"gcube-token": self.gcube_token},
-        )
-        r.raise_for_status()
+        fields = [
+            ("name", "%s-%s" % (input_name, self.call_id)),
+            ("file", (os.path.basename(fname), fname)),
+            ("description", "Input %s for DataMiner execution" % input_name),
+        ]
+        with self.metrics.span("upload"):
+            r = self._post_file(
+                base_url + "/items/%s/create/FILE" % self.folder_id, fields, fname
+            )
+            file_id = r.text
+            r = self.session.get(
+                base_url + "/items/%s/publiclink" % file_id,
+                params={"gcube-token": self.gcube_token},
+                hedge=True,
+            )
+            r.raise_for_status()
         # D4Science returns the id with quotes :(
         return r.text.strip('"')
 
+    def _post_file(self, url, fields, fname):
+        # the body is streamed from the file, so memory does not grow with
+        # its size. StorageHub has no resumable uploads, failed attempts are
+        # started again from the beginning
+        import requests
+
+        from galaxy_dataminer.multipart import MultipartEncoder
+
+        log_progress = upload_progress(fname)
+
+        def progress(done, total):
+            # called for every block read, raising stops the request
+            if self.cancelled.is_set():
+                raise Exception("Upload of %s cancelled" % fname)
+            log_progress(done, total)
+
+        backoff = Backoff(UPLOAD_RETRY_DELAY, maximum=UPLOAD_RETRY_DELAY * 8)
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            body = MultipartEncoder(fields, progress)
+            try:
+                r = self.session.post(
+                    url,
+                    params={"gcube-token": self.gcube_token},
+                    data=body,
+                    headers={"Content-Type": body.content_type},
+                )
+                if r.status_code < 500 or attempt == UPLOAD_ATTEMPTS:
+                    r.raise_for_status()
+                    return r
+                error = "HTTP %d" % r.status_code
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+                error = e
+            logging.warning(
+                "Upload of %s failed (attempt %d of %d): %s",
+                fname,
+                attempt,
+                UPLOAD_ATTEMPTS,
+                error,
+            )
+            self.metrics.incr("uploads.retries")
+            time.sleep(backoff.next())
+
+
+def upload_progress(fname):
+    # logs each 10% of the upload of fname
+    logged = [-1]
+
+    def progress(done, total):
+        step = 10 * done // total if total else 10
+        if step > logged[0]:
+            logged[0] = step
+            logging.info(
+                "Uploading %s: %d%% (%d of %d bytes)",
+                fname,
+                100 * done // total if total else 100,
+                done,
+                total,
+            )
+
+    return progress
+
+
+def described(process):
+    # process may be a Future of the DescribeProcess call
+    return process.result() if isinstance(process, Future) else process
+
+
+def data_input_url(name, path, sh):
+    # URL DataMiner gets the dataset from: if it is the HTML of a previous
+    # execution, its output; otherwise the file uploaded to the StorageHub
+    manifest = galaxy_manifest(path)
+    if manifest:
+        out = find_output(manifest)
+        if out:
+            logging.info("Assuming %s as the right input for the process", out)
+            return out["url"]
+    html = sniff_html(path)
+    if html is None:
+        import magic
+
+        html = magic.from_file(path, mime=True) == "text/html"
+    if html:
+        # html, try to read it and get the output description
+        outputs = read_dataminer_data(path)
+        # try to guess which one is the right input
+        if outputs:
+            for out in outputs.get("outputs", []):
+                # discard 'Log of the computation.csv'
+                if out["descriptor"] == "Log of the computation":
+                    continue
+                logging.info("Assuming %s as the right input for the process", out)
+                return out["url"]
+    # we are here, so the html was not working as expected so just copy
+    # to the StorageHub
+    return sh.upload_file(name, path)
+
+
+def build_input(arg, process_inputs):
+    # text inputs, data inputs are resolved by build_inputs
+    from galaxy import util
+    from owslib.wps import ComplexDataInput
 
-def build_input(arg, is_data, process_inputs, sh):
     k, v = arg.split("=", 1)
     if not v:
         # skip those not specified, hopefully there will be some sane default
@@ -114,166 +378,518 @@ def build_input(arg, is_data, process_inputs, sh):
         # weird, not one of inputs, ignore
         return None
     clean_v = util.restore_text(v)
-    if is_data:
-        file_url = None
-        # really data? check if HTML of previous dataminer
-        if magic.from_file(clean_v, mime=True) == "text/html":
-            # html, try to read it and get the output description
-            parser = CallerHTMLParser()
-            parser.feed(open(clean_v).read())
-            outputs = parser.caller_dataminer_data()
-            # try to guess which one is the right input
-            if outputs:
-                for out in outputs.get("outputs", []):
-                    # discard 'Log of the computation.csv'
-                    if out["descriptor"] == "Log of the computation":
-                        continue
-                    logging.info("Assuming %s as the right input for the process", out)
-                    file_url = out["url"]
-                    break
-        if not file_url:
-            # we are here, so the html was not working as expected so just copy
-            # to the StorageHub
-            file_url = sh.upload_file(k, clean_v)
-        return (k, ComplexDataInput(file_url, mimeType="text/xml"))
+    if inp.dataType == "ComplexData":
+        # assume text/xml is fine always?
+        return (k, ComplexDataInput(clean_v, mimeType="text/xml"))
     else:
-        if inp.dataType == "ComplexData":
-            # assume text/xml is fine always?
-            return (k, ComplexDataInput(clean_v, mimeType="text/xml"))
-        else:
-            # let's assume just taking the value is ok
-            return (k, clean_v)
-
-
-def build_inputs(process, text_in, data_in, gcube_token):
-    # build a dict to ease input handling later on
-    process_inputs = {}
-    for i in process.dataInputs:
-        process_inputs[i.identifier] = i
-
-    sh = StorageHub(gcube_token)
-    inputs = []
-    if text_in:
-        for arg in text_in:
-            inp = build_input(arg, False, process_inputs, sh)
-            if inp:
-                inputs.append(inp)
-    if data_in:
-        sh.create_galaxy_folder()
-        for arg in data_in:
-            inp = build_input(arg, True, process_inputs, sh)
-            if inp:
-                inputs.append(inp)
+        # let's assume just taking the value is ok
+        return (k, clean_v)
+
+
+def build_inputs(process, text_in, data_in, sh, jobs=1):
+    # process may be a Future of the description: data inputs do not need
+    # it, so they are resolved (and uploaded) concurrently while it is not
+    # there, those the process does not have are dropped afterwards. If
+    # anything fails, uploads still running are aborted and those not
+    # started are cancelled, the job is not going to run
+    from galaxy import util
+    from owslib.wps import ComplexDataInput
+
+    def resolve(arg):
+        k, v = arg.split("=", 1)
+        if not v:
+            # skip those not specified, hopefully there will be some sane default
+            return None
+        return (k, data_input_url(k, util.restore_text(v), sh))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        resolved = [submit(executor, resolve, arg) for arg in data_in or []]
+
+        # build a dict to ease input handling later on
+        process_inputs = {}
+        for i in described(process).dataInputs:
+            process_inputs[i.identifier] = i
+
+        inputs = []
+        if text_in:
+            for arg in text_in:
+                inp = build_input(arg, process_inputs)
+                if inp:
+                    inputs.append(inp)
+        for future in resolved:
+            inp = future.result()
+            if not inp:
+                continue
+            if inp[0] not in process_inputs:
+                # weird, not one of inputs, ignore
+                logging.warning("Ignoring unknown input %s", inp[0])
+                continue
+            inputs.append((inp[0], ComplexDataInput(inp[1], mimeType="text/xml")))
+    except BaseException:
+        sh.cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
     return inputs
 
 
-def produce_output(execution, outfile, outdir, gcube_vre_token_header):
-    # Build some simple HTML output with the links to the actual output
-    html = ["<html><body><h1>DataMiner algorithm: %s</h1>" % execution.process.title]
-
-    exec_id = ""
+def execution_id(execution):
     status_url = urlparse.urlparse(execution.statusLocation)
     if status_url[4]:
         exec_id = urlparse.parse_qs(status_url[4]).get("id", "")
         if exec_id:
-            exec_id = exec_id.pop()
+            return exec_id.pop()
+    return ""
 
-    output_dict = {"outputs": []}
-    if execution.status == "ProcessSucceeded":
+
+def write_html(outfile, title, status, exec_id, output_dict, errors=None, metrics=None):
+    # Build some simple HTML output with the links to the actual output
+    metrics = metrics or Metrics()
+    html = ["<html><body><h1>DataMiner algorithm: %s</h1>" % title]
+    if status == "ProcessSucceeded":
         html.append("<h2>Outputs:</h2>")
         html.append("<ul>")
-        for out in execution.processOutputs:
-            if not out.fileName:
-                continue
-            tree = etree.parse(out.fileName)
-            featMembers = tree.findall("{http://www.opengis.net/gml}featureMember")
-            results = featMembers[0].findall("{http://ogr.maptools.org/}Result")
-
-            for result in results:
-                data = result.find("{http://www.d4science.org}Data")
-                mime_type = result.find("{http://www.d4science.org}MimeType")
-                extension = mimetypes.guess_extension(mime_type.text)
-                if not extension:
-                    extension = ""
-                desc = result.find("{http://www.d4science.org}Description")
-                r = requests.get(data.text, stream=True, headers=gcube_vre_token_header)
-
-                # Throw an error for bad status codes
-                r.raise_for_status()
-
-                file_name = "%s%s" % (desc.text, extension)
-                with open(os.path.join(outdir, file_name), "wb") as handle:
-                    for block in r.iter_content(1024):
-                        handle.write(block)
-                html.append('<li><a href="%s">%s</a></li>' % (file_name, desc.text))
-                output_dict["outputs"].append(
-                    {
-                        "name": file_name,
-                        "mime_type": mime_type.text,
-                        "descriptor": desc.text,
-                        "url": data.text,
-                    }
-                )
+        for result in output_dict["outputs"]:
+            html.append('<li><a href="%(name)s">%(descriptor)s</a></li>' % result)
         html.append("</ul>")
     else:
         html.append("<h2>Error:</h2>")
         html.append("<ul>")
-        logging.error("Something went wrong:")
-        for e in execution.errors:
-            html.append("<li><pre>%s</pre></li>" % e.text)
-            logging.error(e.text)
+        for e in errors or []:
+            html.append("<li><pre>%s</pre></li>" % e)
         html.append("</ul>")
 
     html.append("<h2>Execution details:</h2><ul>")
-    html.append("<li>Status: %s</li>" % execution.status)
+    html.append("<li>Status: %s</li>" % status)
     html.append("<li>ID: %s</li>" % exec_id)
+    if output_dict.get("cached"):
+        html.append("<li>Reused the result of a previous execution</li>")
     html.append('<li><a href="%s">WPS log</a></li>' % LOGFILE)
+    html.append('<li><a href="%s">Metrics</a></li>' % METRICS_FILE)
     html.append("</ul>")
+    html.append("<h2>Timings:</h2>")
+    html.append(metrics.to_html())
     html.append('<script type="application/json" id="dataminer-output">')
     html.append(json.dumps(output_dict))
     html.append("</script>")
     html.append("</body></html>")
     if outfile:
-        with open(outfile, "w") as ofile:
+        with metrics.span("html"), open(outfile, "w") as ofile:
             ofile.write("".join(html))
 
 
-def call_wps(args):
-    if not args.token:
-        user_id = args.user
-        if not user_id:
-            logging.error("No user id found on the call, aborting!")
-            sys.exit(1)
-        user_token_file = os.path.join("/etc/d4science/", user_id)
-        with open(user_token_file, "r") as f:
-            gcube_vre_token = f.read()
+def produce_output(
+    execution,
+    outfile,
+    outdir,
+    gcube_vre_token_header,
+    jobs=1,
+    session=None,
+    metrics=None,
+):
+    # returns the description of the outputs, as embedded in the HTML
+    import requests
+
+    from galaxy_dataminer.download import download
+    from galaxy_dataminer.results import iter_results, open_output
+
+    metrics = metrics or Metrics()
+    output_dict = {"outputs": []}
+    errors = []
+    if execution.status == "ProcessSucceeded":
+
+        def fetch(result):
+            path = os.path.join(outdir, result["name"])
+            with metrics.span("download"):
+                size, sha256 = download(
+                    result["url"], path, headers=gcube_vre_token_header, session=session
+                )
+            metrics.incr("downloads")
+            metrics.incr("bytes.downloaded", size)
+            result.update(size=size, sha256=sha256)
+
+        # only the first output holds the DataMiner results (it is the one
+        # owslib getOutput retrieves). Its Result entries are streamed and
+        # each download starts as soon as the entry is parsed, futures are
+        # kept in order for the HTML and JSON outputs
+        downloads = []
+        names = set()
+        with metrics.span("outputs"), ThreadPoolExecutor(
+            max_workers=max(1, jobs)
+        ) as executor:
+            for out in execution.processOutputs[:1]:
+                source = open_output(out, session or requests, gcube_vre_token_header)
+                if source is None:
+                    continue
+                try:
+                    for data, mime_type, desc in iter_results(source):
+                        extension = mimetypes.guess_extension(mime_type)
+                        if not extension:
+                            extension = ""
+                        # downloads run concurrently, each one needs its own
+                        # file even if DataMiner repeats a description
+                        name = "%s%s" % (desc, extension)
+                        n = 1
+                        while name in names:
+                            n += 1
+                            name = "%s (%d)%s" % (desc, n, extension)
+                        names.add(name)
+                        result = {
+                            "name": name,
+                            "mime_type": mime_type,
+                            "descriptor": desc,
+                            "url": data,
+                        }
+                        downloads.append((result, submit(executor, fetch, result)))
+                finally:
+                    source.close()
+            for result, future in downloads:
+                future.result()
+                logging.info("Downloaded %(name)s (%(size)d bytes)", result)
+                output_dict["outputs"].append(result)
+        write_manifest(outdir, output_dict["outputs"])
     else:
-        gcube_vre_token = args.token.encode("utf-8")
+        logging.error("Something went wrong:")
+        for e in execution.errors:
+            errors.append(e.text)
+            logging.error(e.text)
 
-    logging.info("User: %s", args.user)
-    logging.info("Token: (SHA256) %s", hashlib.sha256(gcube_vre_token).hexdigest())
+    write_html(
+        outfile,
+        execution.process.title,
+        execution.status,
+        execution_id(execution),
+        output_dict,
+        errors,
+        metrics,
+    )
+    return output_dict
 
-    gcube_vre_token_header = {"gcube-token": gcube_vre_token}
 
-    dataminer_url = (
-        "http://dataminer-prototypes.d4science.org/wps/" "WebProcessingService"
+def read_token(args):
+    if args.token:
+        return args.token.encode("utf-8")
+    if not args.user:
+        return None
+    user_token_file = os.path.join("/etc/d4science/", args.user)
+    with open(user_token_file, "rb") as f:
+        # a trailing newline makes it an invalid header value
+        return f.read().strip()
+
+
+def storage_hub(
+    gcube_token, session, cache_dir, registry_url=REGISTRY_URL, metrics=None
+):
+    cache = upload_index = None
+    if cache_dir:
+        cache = TTLCache(os.path.join(cache_dir, DISCOVERY_CACHE), DISCOVERY_TTL)
+        upload_index = TTLCache(os.path.join(cache_dir, UPLOAD_INDEX), UPLOAD_TTL)
+    sh = StorageHub(gcube_token, cache, session, upload_index)
+    sh.registry_url = registry_url
+    if metrics:
+        sh.metrics = metrics
+    return sh
+
+
+def result_key(process, text_in, data_in, gcube_token):
+    # same inputs build_inputs would use, with the content hash of the
+    # datasets instead of their StorageHub links, so it is known before
+    # uploading anything. Datasets are hashed before waiting for the
+    # description of the process
+    from galaxy import util
+
+    items = []
+    for is_data, args in ((False, text_in), (True, data_in)):
+        for arg in args or []:
+            k, v = arg.split("=", 1)
+            if not v:
+                continue
+            v = util.restore_text(v)
+            if is_data:
+                v = "sha256:%s" % file_sha256(v)
+            items.append([k, is_data, v])
+    process = described(process)
+    process_inputs = set(i.identifier for i in process.dataInputs)
+    items = [i for i in items if i[0] in process_inputs]
+    data = json.dumps(
+        [process.identifier, process.processVersion, token_key(gcube_token)]
+        + sorted(items)
     )
-    wps = WebProcessingService(dataminer_url, headers=gcube_vre_token_header)
-    process_id = args.process
-    process = wps.describeprocess(process_id)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
 
-    inputs = build_inputs(process, args.input, args.inputdata, gcube_vre_token)
+
+def reuse_result(cached, process, args, metrics):
+    # reproduces the outdir and HTML of a previous execution
+    from galaxy_dataminer.extract import copy_output
+
+    path, result = cached
+    output_dict = dict(result["outputs"], cached=True)
+    for out in output_dict["outputs"]:
+        copy_output(
+            os.path.join(path, out["name"]),
+            os.path.join(args.outdir, out["name"]),
+        )
+    logging.info("Reusing the result of execution %s", result["id"])
+    metrics.incr("results.reused")
+    write_manifest(args.outdir, output_dict["outputs"])
+    write_html(
+        args.output,
+        process.title,
+        "ProcessSucceeded",
+        result["id"],
+        output_dict,
+        metrics=metrics,
+    )
+
+
+def write_metrics(metrics, args):
+    # metrics.json always goes to the outdir, --metrics-file relative to it
+    try:
+        metrics.write(os.path.join(args.outdir, METRICS_FILE))
+        if args.metrics_file:
+            metrics.write(
+                os.path.join(args.outdir, args.metrics_file), args.metrics_format
+            )
+    except (IOError, OSError) as e:
+        logging.warning("Cannot write metrics: %s", e)
+
+
+def execute_process(wps, process, args, sh, session, metrics=None):
+    # process is the owslib Process, or a Future of it so the inputs are
+    # prepared while DescribeProcess is still running
+    metrics = metrics or Metrics()
+    results = key = None
+    if args.result_cache and args.cache_dir:
+        results = ResultCache(
+            args.cache_dir,
+            args.result_cache_size * 1024 * 1024,
+            args.result_cache_age * 3600,
+        )
+        with metrics.span("result_cache"):
+            key = result_key(process, args.input, args.inputdata, sh.gcube_token)
+            cached = results.get(key)
+        if cached:
+            reuse_result(cached, described(process), args, metrics)
+            metrics.labels["status"] = "ProcessSucceeded"
+            return 0
+    with metrics.span("inputs"):
+        inputs = build_inputs(process, args.input, args.inputdata, sh, args.upload_jobs)
+    process = described(process)
     outputs = [(o.identifier, True) for o in process.processOutputs]
     # execute the process
-    execution = wps.execute(process_id, inputs, outputs)
-    monitorExecution(execution, sleepSecs=5, download=True)
+    with metrics.span("execute"):
+        execution = wps.execute(process.identifier, inputs, outputs)
+    backoff = Backoff(args.poll_initial, args.poll_factor, args.poll_max)
+    handed_over = False
+    if args.agent_socket:
+        from galaxy_dataminer.agent import wait_execution
+
+        handed_over = wait_execution(
+            args.agent_socket, execution, wps.headers, backoff, metrics
+        )
+    if not handed_over:
+        monitor_execution(wps, execution, backoff, metrics)
     logging.info("Execution status: %s", execution.status)
+    metrics.labels["status"] = execution.status
     exit_code = 0 if execution.status == "ProcessSucceeded" else 1
+    if exit_code != 0:
+        sh.forget_reused()
     logging.info("Exit code: %d", exit_code)
-    produce_output(execution, args.output, args.outdir, gcube_vre_token_header)
+    output_dict = produce_output(
+        execution,
+        args.output,
+        args.outdir,
+        wps.headers,
+        args.download_jobs,
+        session,
+        metrics,
+    )
+    if results and exit_code == 0:
+        files = [os.path.join(args.outdir, o["name"]) for o in output_dict["outputs"]]
+        result = {"id": execution_id(execution), "outputs": output_dict}
+        with metrics.span("result_cache"):
+            results.put(key, result, files)
     return exit_code
 
 
+def call_wps(args):
+    metrics = Metrics(process=args.process)
+    try:
+        return _call_wps(args, metrics)
+    finally:
+        write_metrics(metrics, args)
+
+
+def _call_wps(args, metrics):
+    from galaxy_dataminer.session import build_session, SessionWPS
+
+    with metrics.span("token"):
+        gcube_vre_token = read_token(args)
+    if gcube_vre_token is None:
+        logging.error("No user id found on the call, aborting!")
+        sys.exit(1)
+
+    logging.info("User: %s", args.user)
+    logging.info("Token: (SHA256) %s", hashlib.sha256(gcube_vre_token).hexdigest())
+
+    gcube_vre_token_header = {"gcube-token": gcube_vre_token}
+
+    session = build_session(
+        args.http_pool_size, args.http_timeout, args.http_host, **http_options(args)
+    )
+    session.hooks["response"].append(metrics.count_response)
+    wps = SessionWPS(
+        args.wps_url, session, headers=gcube_vre_token_header, skip_caps=True
+    )
+
+    def describe():
+        with metrics.span("describe_process"):
+            return wps.describeprocess(args.process)
+
+    sh = storage_hub(
+        gcube_vre_token, session, args.cache_dir, args.registry_url, metrics
+    )
+    try:
+        # DescribeProcess runs while the inputs are prepared
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            process = submit(executor, describe)
+            return execute_process(wps, process, args, sh, session, metrics)
+    finally:
+        for name, value in session.log_stats().items():
+            if name != "requests" and value:
+                metrics.incr("http.%s" % name, value)
+        session.close()
+
+
+def http_options(args):
+    # retry, hedging and circuit breaker settings of build_session
+    return {
+        "retries": args.http_retries,
+        "hedge_delay": args.http_hedge,
+        "breaker_threshold": args.http_breaker_threshold,
+        "breaker_cooldown": args.http_breaker_cooldown,
+    }
+
+
+def add_execution_arguments(parser):
+    parser.add_argument(
+        "--wps-url", default=DATAMINER_URL, help="DataMiner WPS endpoint"
+    )
+    parser.add_argument(
+        "--registry-url",
+        default=REGISTRY_URL,
+        help="Information System query returning the StorageHub endpoint",
+    )
+    parser.add_argument(
+        "--upload-jobs",
+        type=int,
+        default=4,
+        help="number of input datasets to upload concurrently",
+    )
+    parser.add_argument(
+        "--download-jobs",
+        type=int,
+        default=4,
+        help="number of outputs to download concurrently",
+    )
+    parser.add_argument(
+        "--poll-initial",
+        type=float,
+        default=0.5,
+        help="seconds before the first execution status check",
+    )
+    parser.add_argument(
+        "--poll-factor",
+        type=float,
+        default=2.0,
+        help="growth factor of the interval between status checks",
+    )
+    parser.add_argument(
+        "--poll-max",
+        type=float,
+        default=60.0,
+        help="maximum seconds between status checks",
+    )
+    parser.add_argument(
+        "--agent-socket",
+        help="hand the status polling over to the dataminer_agent listening "
+        "on this Unix socket (polls by itself if it is not there)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory for data cached across invocations (empty to disable)",
+    )
+    parser.add_argument(
+        "--result-cache",
+        action="store_true",
+        help="reuse the outputs of a previous execution of the same process "
+        "version with the same inputs, kept in the cache directory",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        default=1024,
+        help="maximum size of the kept outputs in MiB",
+    )
+    parser.add_argument(
+        "--result-cache-age",
+        type=float,
+        default=7 * 24,
+        help="hours the outputs of an execution are reused",
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=int,
+        default=10,
+        help="maximum number of pooled connections per host",
+    )
+    parser.add_argument(
+        "--http-timeout", type=float, help="default HTTP timeout in seconds"
+    )
+    parser.add_argument(
+        "--http-host",
+        action="append",
+        help="per host connection settings as HOST=POOL_SIZE[,TIMEOUT]",
+    )
+    parser.add_argument(
+        "--http-retries",
+        type=int,
+        default=3,
+        help="times a failed GET, HEAD, PUT or DELETE is retried",
+    )
+    parser.add_argument(
+        "--http-hedge",
+        type=float,
+        help="seconds after which a slow public link or result download is "
+        "requested again, keeping the first answer (disabled by default)",
+    )
+    parser.add_argument(
+        "--http-breaker-threshold",
+        type=int,
+        default=5,
+        help="consecutive failures after which requests to a host are "
+        "rejected (0 to disable)",
+    )
+    parser.add_argument(
+        "--http-breaker-cooldown",
+        type=float,
+        default=30.0,
+        help="seconds before requests to a failing host are tried again",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="also write the metrics to this file (relative to the outdir)",
+    )
+    parser.add_argument(
+        "--metrics-format",
+        choices=FORMATS,
+        default="prometheus",
+        help="format of --metrics-file",
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description="Call the DataMiner processes")
     parser.add_argument("--process", help="id of the process")
@@ -285,6 +901,13 @@ def main():
     parser.add_argument("--outdir", help="output directory")
     parser.add_argument("--user", help="user")
     parser.add_argument("--token", help="gcube-token")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="write cProfile stats of the main thread to %s in the outdir"
+        % PROFILE_FILE,
+    )
+    add_execution_arguments(parser)
 
     args = parser.parse_args()
 
@@ -315,7 +938,18 @@ def main():
             "Token: (SHA256) %s", hashlib.sha256(args.token.encode("utf-8")).hexdigest()
         )
 
-    exit_code = call_wps(args)
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        exit_code = call_wps(args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(args.outdir, PROFILE_FILE))
     if exit_code != 0:
         logging.error("Error on wps execution!")
     sys.exit(exit_code)
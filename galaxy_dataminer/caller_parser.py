@@ -1,7 +1,15 @@
+import contextlib
 import json
+import mmap
+import os
 
 from six.moves.html_parser import HTMLParser
 
+DATAMINER_SCRIPT_ID = b'id="dataminer-output"'
+SCRIPT_END = b"</script>"
+HTML_PREFIXES = (b"<html", b"<!doctype html")
+SNIFF_SIZE = 512
+
 
 class CallerHTMLParser(HTMLParser):
     def handle_starttag(self, tag, attrs):
@@ -19,3 +27,50 @@ class CallerHTMLParser(HTMLParser):
 
     def caller_dataminer_data(self):
         return getattr(self, "_caller_dataminer_data", None)
+
+
+def sniff_html(path):
+    # True/False if the first bytes tell whether this is HTML, None if it
+    # looks like markup but cannot be told from the prefix alone
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+    head = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if head.startswith(HTML_PREFIXES):
+        return True
+    if head.startswith(b"<"):
+        return None
+    return False
+
+
+def find_dataminer_data(path):
+    # produce_output writes the dataminer-output script at the very end of
+    # the file, so search it backwards on a memory map and only decode the
+    # JSON. Returns None if it is not there.
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with contextlib.closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as m:
+            marker = m.rfind(DATAMINER_SCRIPT_ID)
+            if marker < 0:
+                return None
+            start = m.find(b">", marker) + 1
+            end = m.find(SCRIPT_END, start)
+            if start == 0 or end < 0:
+                return None
+            try:
+                return json.loads(m[start:end].decode("utf-8"))
+            except ValueError:
+                return None
+
+
+def read_dataminer_data(path):
+    data = find_dataminer_data(path)
+    if data is not None:
+        return data
+    # not where expected, go through the whole document
+    parser = CallerHTMLParser()
+    with open(path, "r") as f:
+        for block in iter(lambda: f.read(1024 * 1024), ""):
+            parser.feed(block)
+    parser.close()
+    return parser.caller_dataminer_data()
@@ -0,0 +1,11 @@
+import contextvars
+
+# batch job the running code works for, call_wps_batch uses it to write the
+# logfile of each job while several of them run in parallel
+job = contextvars.ContextVar("job", default=None)
+
+
+def submit(executor, fn, *args, **kwargs):
+    # executor.submit running fn in a copy of the current context, so the
+    # job follows the work into the pool threads
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
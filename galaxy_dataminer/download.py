@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import os
+import os.path
+
+import requests
+
+CHUNK_SIZE_MIN = 64 * 1024
+CHUNK_SIZE_MAX = 4 * 1024 * 1024
+MAX_RESUMES = 5
+PART_SUFFIX = ".part"
+
+RESUMABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+
+def chunk_size_for(length):
+    # aim for ~64 reads per file, bounded so small files do not allocate big
+    # buffers and big ones do not spend their time in the python loop
+    if not length:
+        return CHUNK_SIZE_MIN
+    return min(max(length // 64, CHUNK_SIZE_MIN), CHUNK_SIZE_MAX)
+
+
+def _expected_size(r, offset):
+    length = r.headers.get("Content-Length")
+    if length is None or r.headers.get("Content-Encoding"):
+        return None
+    return int(length) + offset
+
+
+def _hash_file(path, digest):
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE_MAX), b""):
+            digest.update(block)
+
+
+def download(url, path, headers=None, session=None):
+    # data goes to path + ".part" until complete, if that file is already
+    # there (e.g. from an interrupted attempt) the download is resumed with a
+    # HTTP Range request. Returns the size and SHA-256 of the file, hashed as
+    # it is written (only a resumed part is read back)
+    if session is None:
+        from galaxy_dataminer.session import build_session
+
+        session = build_session()
+    part = path + PART_SUFFIX
+    resumes = 0
+    while True:
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        req_headers = dict(headers or {})
+        if offset:
+            req_headers["Range"] = "bytes=%d-" % offset
+        r = session.get(url, stream=True, headers=req_headers, hedge=True)
+        try:
+            if offset and r.status_code == 416:
+                # partial file does not match the remote one, start again
+                os.unlink(part)
+                continue
+            # Throw an error for bad status codes
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                logging.debug("Server ignored range request for %s", url)
+                offset = 0
+            expected = _expected_size(r, offset)
+            digest = hashlib.sha256()
+            if offset:
+                _hash_file(part, digest)
+            with open(part, "ab" if offset else "wb") as handle:
+                for block in r.iter_content(chunk_size_for(expected)):
+                    handle.write(block)
+                    digest.update(block)
+            if expected is None or os.path.getsize(part) >= expected:
+                break
+            error = "short read"
+        except RESUMABLE_ERRORS as e:
+            error = e
+        finally:
+            r.close()
+        resumes += 1
+        if resumes > MAX_RESUMES:
+            raise Exception("Cannot download %s: %s" % (url, error))
+        logging.warning("Download of %s interrupted (%s), resuming", url, error)
+    os.replace(part, path)
+    return os.path.getsize(path), digest.hexdigest()
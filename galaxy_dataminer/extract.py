@@ -1,10 +1,111 @@
 import argparse
 import json
+import logging
 import os
 import os.path
 import shutil
 
-from galaxy_dataminer.caller_parser import CallerHTMLParser
+from galaxy_dataminer.caller_parser import read_dataminer_data
+from galaxy_dataminer.manifest import find_output, MANIFEST_FILE, read_manifest
+
+# ioctl to share the data blocks of two files (btrfs, xfs, ...)
+FICLONE = 0x40049409
+COPY_BLOCK = 1024 * 1024
+
+
+def _reflink(fsrc, fdst):
+    import fcntl
+
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc, fdst, size):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+        if n == 0:
+            raise OSError("short copy: %d of %d bytes" % (copied, size))
+        copied += n
+
+
+def _sendfile(fsrc, fdst, size):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, size - copied)
+        if n == 0:
+            raise OSError("short copy: %d of %d bytes" % (copied, size))
+        copied += n
+
+
+def _check_copy(fdst, size):
+    fdst.flush()
+    copied = os.fstat(fdst.fileno()).st_size
+    if copied != size:
+        raise OSError("short copy: %d of %d bytes" % (copied, size))
+
+
+def copy_output(src, dst, hardlink=False):
+    # cheapest way to get src into dst: a hard link if allowed, then a
+    # reflink, then a copy done in the kernel, plain copy as last resort.
+    # Returns the method used.
+    if hardlink:
+        tmp = "%s.%d.tmp" % (dst, os.getpid())
+        try:
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return "hardlink"
+        except OSError as e:
+            logging.debug("Cannot hardlink %s: %s", src, e)
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        methods = [("reflink", lambda: _reflink(fsrc, fdst))]
+        if hasattr(os, "copy_file_range"):
+            methods.append(
+                ("copy_file_range", lambda: _copy_file_range(fsrc, fdst, size))
+            )
+        if hasattr(os, "sendfile"):
+            methods.append(("sendfile", lambda: _sendfile(fsrc, fdst, size)))
+        for name, method in methods:
+            try:
+                method()
+                _check_copy(fdst, size)
+                return name
+            except (IOError, OSError) as e:
+                logging.debug("Cannot %s %s: %s", name, src, e)
+                # start again from scratch with the next method
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, COPY_BLOCK)
+        _check_copy(fdst, size)
+    return "copy"
+
+
+def check_size(path, output):
+    # cheap integrity check, the sha256 in the manifest is there for
+    # whoever needs to read the whole file anyway
+    size = output.get("size")
+    if size is not None and os.path.getsize(path) != size:
+        raise Exception(
+            "%s has %d bytes, %d expected" % (path, os.path.getsize(path), size)
+        )
+
+
+def select_output(outfiles, descriptor=None):
+    if descriptor:
+        for f in outfiles:
+            if f["descriptor"] == descriptor:
+                return f
+    else:
+        for f in outfiles:
+            # do not use 'Log of the computation'
+            if (
+                f["mime_type"] == "text/csv"
+                and f["descriptor"] != "Log of the computation"
+            ):
+                return f
+    raise Exception("Output not found")
+
 
 def main():
     arg_parser = argparse.ArgumentParser(
@@ -14,37 +115,44 @@ def main():
         "--inputdata", help="Galaxy dataset coming from dataminer execution"
     )
     arg_parser.add_argument("--inputdir", help="Extra files path for input")
-    arg_parser.add_argument("--descriptor", help="File to get from the output")
-    arg_parser.add_argument("--output", help="output file")
+    arg_parser.add_argument(
+        "--descriptor",
+        action="append",
+        help="File to get from the output (can be repeated, one per --output)",
+    )
+    arg_parser.add_argument(
+        "--output", action="append", help="output file (can be repeated)"
+    )
+    arg_parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help="hard link the outputs instead of copying them when possible",
+    )
 
     args = arg_parser.parse_args()
-    html_parser = CallerHTMLParser()
-
-    with open(os.path.join(args.inputdata), "r") as f:
-        html_parser.feed(f.read())
 
-    outfiles = html_parser.caller_dataminer_data().get("outputs", [])
+    descriptors = args.descriptor or [None]
+    outputs = args.output or []
+    if len(descriptors) != len(outputs):
+        arg_parser.error("--descriptor and --output must be given the same times")
 
-    if args.descriptor:
-        for f in outfiles:
-            if f["descriptor"] == args.descriptor:
-                src = os.path.join(args.inputdir, f["name"])
-                shutil.copyfile(src, args.output)
-                break
-        else:
+    # find all of them before copying anything, from the manifest that
+    # call_wps leaves in the extra files if it is there
+    manifest = read_manifest(os.path.join(args.inputdir, MANIFEST_FILE))
+    if manifest:
+        selected = [
+            find_output(manifest, d, None if d else "text/csv") for d in descriptors
+        ]
+        if None in selected:
             raise Exception("Output not found")
     else:
-        for f in outfiles:
-            # do not use 'Log of the computation'
-            if (
-                f["mime_type"] == "text/csv"
-                and f["descriptor"] != "Log of the computation"
-            ):
-                src = os.path.join(args.inputdir, f["name"])
-                shutil.copyfile(src, args.output)
-                break
-        else:
-            raise Exception("Output not found")
+        outfiles = read_dataminer_data(args.inputdata).get("outputs", [])
+        selected = [select_output(outfiles, d) for d in descriptors]
+    for f, output in zip(selected, outputs):
+        src = os.path.join(args.inputdir, f["name"])
+        check_size(src, f)
+        method = copy_output(src, output, args.hardlink)
+        logging.debug("%s copied to %s (%s)", src, output, method)
 
 
 if __name__ == "__main__":
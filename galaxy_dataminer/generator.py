@@ -1,16 +1,27 @@
 from __future__ import print_function
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import json
 import logging
 import os
-import shutil
+import re
+import subprocess
 import sys
+import time
 
-import requests
-from owslib.wps import WebProcessingService, ComplexDataInput, monitorExecution
-from owslib.wps import printInputOutput
 from lxml import etree
-from xml.dom import minidom
+
+from galaxy_dataminer.cache import (
+    DescribeProcessCache,
+    safe_name,
+    write_if_changed,
+)
+from galaxy_dataminer.caller import DATAMINER_URL
+
+TOOLS_STATE = "tools.json"
+LEGACY_TOOL = re.compile(r"^tool[0-9]{2,}\.xml$")
 
 
 def complex_data_input(input_attrs):
@@ -36,7 +47,7 @@ def complex_data_input(input_attrs):
     return cond
 
 
-def generate_tool_description(process, descr, tool_file):
+def build_tool_description(process, descr):
     tool_attrs = {
         "version": process.processVersion,
         "id": "d4science:%s" % process.identifier,
@@ -80,47 +91,220 @@ def generate_tool_description(process, descr, tool_file):
         }
         etree.SubElement(outputs, "data", attrib=output_attrs)
     etree.SubElement(tool, "help").text = descr.abstract
-    xmlstr = minidom.parseString(etree.tostring(tool)).toprettyxml(indent="  ")
-    with open(tool_file, "wb") as f:
-        f.write(xmlstr.encode("utf-8"))
+    return pretty_xml(tool)
+
+
+def pretty_xml(elem):
+    # indented XML in a single serialization, no re-parsing
+    etree.indent(elem, space="  ")
+    return etree.tostring(elem, xml_declaration=True, encoding="utf-8") + b"\n"
+
+
+def write_config(root, output):
+    # indented tool config written incrementally to the binary file output,
+    # one child of the root at a time, so a config with thousands of tools
+    # is never held as a whole string
+    with etree.xmlfile(output, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element(root.tag, attrib=dict(root.attrib)):
+            for child in root:
+                # comments and processing instructions cannot be indented
+                if isinstance(child.tag, str):
+                    etree.indent(child, space="  ", level=1)
+                xf.write("\n  ")
+                xf.write(child, with_tail=False)
+            xf.write("\n")
+
+
+def generate_tool_description(process, descr, tool_file):
+    return write_if_changed(tool_file, build_tool_description(process, descr))
+
+
+def describe_process(wps, process, cache=None):
+    version = process.processVersion
+    xml = cache.get(process.identifier, version) if cache else None
+    if xml is None:
+        xml = wps.describeprocess_xml(process.identifier)
+        if cache:
+            cache.put(process.identifier, version, xml)
+    return wps.describeprocess(process.identifier, xml=xml)
+
+
+def tool_file_name(process):
+    # stable per process so adding or removing an algorithm does not rename
+    # the files of the others
+    return "%s.xml" % safe_name(process.identifier)
+
+
+def remove_stale_tools(tool_dir, cache_dir, tool_files):
+    # returns the names of the removed tool files
+    state_file = os.path.join(cache_dir, TOOLS_STATE)
+    try:
+        with open(state_file, "r") as f:
+            previous = json.load(f)
+    except (IOError, ValueError):
+        # first run with per process names, drop the toolNN.xml files named
+        # after the position of the process in the capabilities
+        previous = [n for n in os.listdir(tool_dir) if LEGACY_TOOL.match(n)]
+    current = sorted(os.path.basename(f) for f in tool_files)
+    if previous == current:
+        return []
+    removed = []
+    for name in set(previous) - set(current):
+        path = os.path.join(tool_dir, name)
+        if os.path.exists(path):
+            logging.info("Removing stale tool %s", path)
+            os.unlink(path)
+            removed.append(name)
+    write_if_changed(state_file, json.dumps(current).encode("utf-8"))
+    return removed
 
 
 def find_section(config, section_id):
     root = config.getroot()
-    sections = root.findall("section")
-    for s in sections:
-        if s.attrib.get("id", "") == section_id:
-            s.clear()
-            s.set("id", section_id)
-            s.set("name", "DataMiner")
-            return s
+    # the lookup is done by libxml2, not by iterating over the sections here
+    for s in root.xpath("section[@id=$id]", id=section_id):
+        s.clear()
+        s.set("id", section_id)
+        s.set("name", "DataMiner")
+        return s
     # no d4science section, so creating one
-    s = etree.Element("section", attrib={"name": "DataMiner", "id": section_id})
+    # same attribute order as a section found on later runs
+    s = etree.Element("section", attrib={"id": section_id, "name": "DataMiner"})
     root.insert(0, s)
     return s
 
 
-def fill_section(section, gcube_vre_token, tool_dir):
-    gcube_vre_token_header = {"gcube-token": gcube_vre_token}
+class Catalog:
+    # processes offered by the WPS and their descriptions, kept between
+    # refreshes so only new or updated processes are described again
+    def __init__(self, gcube_vre_token, tool_dir, jobs=1, cache_dir=None, url=None):
+        # owslib and requests are only needed here
+        from galaxy_dataminer.session import build_session, SessionWPS
 
-    dataminer_url = (
-        "http://dataminer-prototypes.d4science.org/wps/" "WebProcessingService"
-    )
-    wps = WebProcessingService(dataminer_url, headers=gcube_vre_token_header)
-
-    tools = {}
-    tools["CSV extractor"] = {"file": os.path.join(tool_dir, "extract.xml")}
-    for process in wps.processes:
-        descr = wps.describeprocess(process.identifier)
-        tools[descr.title] = {"descr": descr, "process": process, "file": None}
-
-    for i, t in enumerate(sorted(tools)):
-        tool_file = os.path.join(tool_dir, "tool%02d.xml" % i)
-        if tools[t]["file"]:
-            shutil.copyfile(tools[t]["file"], tool_file)
-        else:
-            generate_tool_description(tools[t]["process"], tools[t]["descr"], tool_file)
-        etree.SubElement(section, "tool", attrib={"file": tool_file})
+        session = build_session(pool_size=max(1, jobs))
+        self.wps = SessionWPS(
+            url or DATAMINER_URL,
+            session,
+            headers={"gcube-token": gcube_vre_token},
+            skip_caps=True,
+        )
+        self.tool_dir = tool_dir
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.cache = DescribeProcessCache(cache_dir) if cache_dir else None
+        # identifier -> (process, description)
+        self.processes = {}
+
+    def refresh(self):
+        # returns the identifiers of the processes that are new or changed
+        # version and of those no longer offered
+        self.wps.getcapabilities()
+        current = dict((p.identifier, p) for p in self.wps.processes)
+        removed = [i for i in self.processes if i not in current]
+        changed = [
+            p
+            for i, p in current.items()
+            if i not in self.processes
+            or self.processes[i][0].processVersion != p.processVersion
+        ]
+        # DescribeProcess calls are independent from each other, fetch them
+        # concurrently. Nothing is kept unless all of them succeed, so a
+        # failed refresh reports the same changes again on the next one
+        with ThreadPoolExecutor(max_workers=max(1, self.jobs)) as executor:
+            descrs = list(
+                executor.map(
+                    lambda p: describe_process(self.wps, p, self.cache), changed
+                )
+            )
+        for process, descr in zip(changed, descrs):
+            self.processes[process.identifier] = (process, descr)
+        for i in removed:
+            del self.processes[i]
+        return [p.identifier for p in changed], removed
+
+    def tool_file(self, identifier):
+        return os.path.join(
+            self.tool_dir, tool_file_name(self.processes[identifier][0])
+        )
+
+    def write_tools(self, identifiers):
+        # returns the tool files actually (re)written
+        updated = []
+        for i in identifiers:
+            process, descr = self.processes[i]
+            tool_file = self.tool_file(i)
+            if generate_tool_description(process, descr, tool_file):
+                logging.info("Updated tool %s", tool_file)
+                updated.append(tool_file)
+        return updated
+
+    def remove_stale_tools(self):
+        if not self.cache_dir:
+            return []
+        return remove_stale_tools(
+            self.tool_dir, self.cache_dir, [self.tool_file(i) for i in self.processes]
+        )
+
+    def fill_section(self, section):
+        # sorted by title, like the tool panel shows them
+        tools = {"CSV extractor": os.path.join(self.tool_dir, "extract.xml")}
+        for i, (process, descr) in self.processes.items():
+            tools[descr.title] = self.tool_file(i)
+        for child in list(section):
+            section.remove(child)
+        for t in sorted(tools):
+            etree.SubElement(section, "tool", attrib={"file": tools[t]})
+
+
+def fill_section(
+    section,
+    gcube_vre_token,
+    tool_dir,
+    jobs=1,
+    cache_dir=None,
+    dataminer_url=DATAMINER_URL,
+):
+    catalog = Catalog(gcube_vre_token, tool_dir, jobs, cache_dir, dataminer_url)
+    changed, _ = catalog.refresh()
+    catalog.write_tools(changed)
+    catalog.fill_section(section)
+    catalog.remove_stale_tools()
+
+
+def sync(catalog, config, section, output, interval, reload_command=None):
+    # keeps the tools and the config up to date with the WPS, polling its
+    # capabilities every interval seconds. Galaxy is only told to reload
+    # when a tool file or the config actually changed
+    while True:
+        try:
+            changed, removed = catalog.refresh()
+            if changed or removed:
+                logging.info(
+                    "%d processes new or updated, %d removed",
+                    len(changed),
+                    len(removed),
+                )
+                updated = catalog.write_tools(changed)
+                updated += catalog.remove_stale_tools()
+                catalog.fill_section(section)
+                data = BytesIO()
+                write_config(config.getroot(), data)
+                if write_if_changed(output, data.getvalue()):
+                    logging.info("Updated config %s", output)
+                    updated.append(output)
+                if updated and reload_command:
+                    logging.info("Reloading Galaxy: %s", reload_command)
+                    exit_code = subprocess.call(reload_command, shell=True)
+                    if exit_code != 0:
+                        logging.error("Reload command exited with %d", exit_code)
+        except Exception:
+            # the WPS may be temporarily unavailable, try again later. The
+            # tools of this round may not have been written, so all of them
+            # are checked again (only those that differ are rewritten)
+            logging.exception("Cannot synchronize the tools")
+            catalog.processes.clear()
+        time.sleep(interval)
 
 
 def main():
@@ -131,24 +315,82 @@ def main():
         "--section", default="d4science", help="name of the d4science section"
     )
     parser.add_argument("--outdir", help="tools configuration directory")
+    parser.add_argument(
+        "--wps-url", default=DATAMINER_URL, help="DataMiner WPS endpoint"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="number of concurrent DescribeProcess requests",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="directory for cached process descriptions "
+        "(default: .cache in the tools configuration directory)",
+    )
+    parser.add_argument(
+        "--output",
+        help="write the updated config to this file (atomically) "
+        "instead of the standard output",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="keep running and update the tools when the WPS processes change "
+        "(the config is updated in --output, or in place)",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=300,
+        help="seconds between checks of the WPS processes in --sync mode",
+    )
+    parser.add_argument(
+        "--reload-command",
+        help="shell command run to make Galaxy reload the tools when something "
+        "changed in --sync mode",
+    )
 
     args = parser.parse_args()
     if not os.path.exists(args.outdir):
         os.makedirs(args.outdir)
 
-    logging.basicConfig(level=logging.ERROR)
+    logging.basicConfig(level=logging.INFO if args.sync else logging.ERROR)
+    # owslib logs whole documents at INFO level
+    logging.getLogger("owslib").setLevel(logging.WARNING)
 
-    config = etree.parse(args.config)
+    # whitespace is dropped so the output is indented consistently
+    config = etree.parse(args.config, etree.XMLParser(remove_blank_text=True))
     root = config.getroot()
 
     with open(args.token, "r") as f:
         token = f.read().strip()
 
+    cache_dir = args.cache_dir or os.path.join(args.outdir, ".cache")
     d4science_config = find_section(config, args.section)
-    fill_section(d4science_config, token, args.outdir)
+    if args.sync:
+        catalog = Catalog(token, args.outdir, args.jobs, cache_dir, args.wps_url)
+        sync(
+            catalog,
+            config,
+            d4science_config,
+            args.output or args.config,
+            args.interval,
+            args.reload_command,
+        )
+        return
+    fill_section(
+        d4science_config, token, args.outdir, args.jobs, cache_dir, args.wps_url
+    )
 
-    xmlstr = minidom.parseString(etree.tostring(root)).toprettyxml(indent="  ")
-    print(xmlstr.encode("utf-8"))
+    if args.output:
+        # left untouched when nothing changed
+        data = BytesIO()
+        write_config(root, data)
+        write_if_changed(args.output, data.getvalue())
+    else:
+        write_config(root, getattr(sys.stdout, "buffer", sys.stdout))
 
 
 if __name__ == "__main__":
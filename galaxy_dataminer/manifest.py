@@ -0,0 +1,67 @@
+import json
+import os.path
+
+MANIFEST_FILE = "dataminer-outputs.json"
+MANIFEST_VERSION = 1
+LOG_DESCRIPTOR = "Log of the computation"
+
+
+def build_manifest(outputs):
+    # outputs as in the dataminer-output JSON of the HTML (name, mime_type,
+    # descriptor, url, size, sha256), indexed by descriptor and by MIME type
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "order": [],
+        "outputs": {},
+        "mime_types": {},
+    }
+    for out in outputs:
+        descriptor = out["descriptor"]
+        manifest["order"].append(descriptor)
+        manifest["outputs"][descriptor] = out
+        manifest["mime_types"].setdefault(out["mime_type"], []).append(descriptor)
+    return manifest
+
+
+def write_manifest(outdir, outputs):
+    # wps_extract only reads manifests, it does not need to import this
+    from galaxy_dataminer.cache import write_atomic
+
+    path = os.path.join(outdir, MANIFEST_FILE)
+    write_atomic(path, json.dumps(build_manifest(outputs)).encode("utf-8"))
+    return path
+
+
+def read_manifest(path):
+    # None if there is no (usable) manifest at path
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def galaxy_manifest(dataset):
+    # manifest of a call_wps HTML dataset, in the extra files directory
+    # Galaxy keeps next to it (dataset_N.dat -> dataset_N_files)
+    return read_manifest(
+        os.path.join("%s_files" % os.path.splitext(dataset)[0], MANIFEST_FILE)
+    )
+
+
+def find_output(manifest, descriptor=None, mime_type=None):
+    # the output with descriptor, or the first one of mime_type (any if not
+    # given) that is not the log. None if there is none
+    if descriptor:
+        return manifest["outputs"].get(descriptor)
+    if mime_type:
+        candidates = manifest["mime_types"].get(mime_type, [])
+    else:
+        candidates = manifest["order"]
+    for d in candidates:
+        if d != LOG_DESCRIPTOR:
+            return manifest["outputs"][d]
+    return None
@@ -0,0 +1,129 @@
+import contextlib
+import json
+import re
+import threading
+import time
+
+from galaxy_dataminer.cache import write_atomic
+
+PREFIX = "galaxy_dataminer"
+FORMATS = ("prometheus", "statsd")
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    # wall clock time spent in each phase and counters of a call. Spans of
+    # the same phase add up (uploads and downloads may overlap, so their
+    # total can be longer than the call), counters are plain sums
+    def __init__(self, **labels):
+        self.start = time.time()
+        self.labels = labels
+        self.timings = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.time() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            count, total = self.timings.get(name, (0, 0.0))
+            self.timings[name] = (count + 1, total + seconds)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_response(self, r, *args, **kwargs):
+        # requests response hook
+        self.incr("http.requests")
+        if r.status_code >= 400:
+            self.incr("http.errors")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "labels": dict(self.labels),
+                "duration": time.time() - self.start,
+                "timings": dict(
+                    (name, {"count": count, "seconds": total})
+                    for name, (count, total) in self.timings.items()
+                ),
+                "counters": dict(self.counters),
+            }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        # text exposition format, as read by the node exporter textfile
+        # collector
+        data = self.to_dict()
+        labels = ",".join(
+            '%s="%s"' % (_metric_name(k), _label_value(v))
+            for k, v in sorted(data["labels"].items())
+        )
+
+        def sample(name, value, extra=""):
+            all_labels = ",".join(l for l in (labels, extra) if l)
+            return "%s_%s{%s} %s" % (PREFIX, name, all_labels, value)
+
+        lines = [
+            "# TYPE %s_duration_seconds gauge" % PREFIX,
+            sample("duration_seconds", data["duration"]),
+            "# TYPE %s_phase_seconds gauge" % PREFIX,
+        ]
+        timings = sorted(data["timings"].items())
+        for name, t in timings:
+            lines.append(sample("phase_seconds", t["seconds"], 'phase="%s"' % name))
+        lines.append("# TYPE %s_phase_count gauge" % PREFIX)
+        for name, t in timings:
+            lines.append(sample("phase_count", t["count"], 'phase="%s"' % name))
+        for name, value in sorted(data["counters"].items()):
+            metric = "%s_total" % _metric_name(name)
+            lines.append("# TYPE %s_%s counter" % (PREFIX, metric))
+            lines.append(sample(metric, value))
+        return "\n".join(lines) + "\n"
+
+    def to_statsd(self):
+        data = self.to_dict()
+        lines = ["%s.duration:%d|ms" % (PREFIX, data["duration"] * 1000)]
+        for name, t in sorted(data["timings"].items()):
+            lines.append("%s.phase.%s:%d|ms" % (PREFIX, name, t["seconds"] * 1000))
+        for name, value in sorted(data["counters"].items()):
+            lines.append("%s.%s:%d|c" % (PREFIX, name, value))
+        return "\n".join(lines) + "\n"
+
+    def to_html(self):
+        data = self.to_dict()
+        html = ["<table><tr><th>Phase</th><th>Count</th><th>Seconds</th></tr>"]
+        for name, t in sorted(data["timings"].items()):
+            html.append(
+                "<tr><td>%s</td><td>%d</td><td>%.3f</td></tr>"
+                % (name, t["count"], t["seconds"])
+            )
+        html.append(
+            "<tr><td>total</td><td></td><td>%.3f</td></tr></table>" % data["duration"]
+        )
+        if data["counters"]:
+            html.append("<table><tr><th>Counter</th><th>Value</th></tr>")
+            for name, value in sorted(data["counters"].items()):
+                html.append("<tr><td>%s</td><td>%d</td></tr>" % (name, value))
+            html.append("</table>")
+        return "".join(html)
+
+    def write(self, path, fmt="json"):
+        data = getattr(self, "to_%s" % fmt)()
+        write_atomic(path, data.encode("utf-8"))
@@ -0,0 +1,86 @@
+import os
+import uuid
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def _quote(value):
+    # same escaping as urllib3 for the parameters of Content-Disposition
+    return value.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartEncoder:
+    # multipart/form-data body that is read a block at a time, so memory use
+    # does not depend on the size of the files. fields is a list of
+    # (name, value), value being a string or a (filename, path) tuple; parts
+    # are the same requests builds for files=. requests streams it when
+    # given as data=, with the content_type as Content-Type header. It can
+    # only be read once, a new one is needed to send the body again
+    def __init__(self, fields, callback=None, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=%s" % self.boundary
+        # called with (bytes read, total bytes) after every read
+        self.callback = callback
+        self._parts = []
+        for name, value in fields:
+            if isinstance(value, tuple):
+                filename, path = value
+                size = os.path.getsize(path)
+            else:
+                filename, path = name, None
+                value = value.encode("utf-8")
+                size = len(value)
+            header = (
+                '--%s\r\nContent-Disposition: form-data; name="%s"; '
+                'filename="%s"\r\n\r\n'
+                % (self.boundary, _quote(name), _quote(filename))
+            ).encode("utf-8")
+            self._parts.append((header, path, value, size))
+        self._tail = ("--%s--\r\n" % self.boundary).encode("utf-8")
+        self.len = sum(len(h) + size + 2 for h, _, _, size in self._parts) + len(
+            self._tail
+        )
+        self.bytes_read = 0
+        self._blocks = self._iter_blocks()
+        self._block = b""
+        self._offset = 0
+
+    def __len__(self):
+        return self.len
+
+    def _iter_blocks(self):
+        for header, path, value, size in self._parts:
+            yield header
+            if path is None:
+                yield value
+            else:
+                with open(path, "rb") as f:
+                    while True:
+                        block = f.read(BLOCK_SIZE)
+                        if not block:
+                            break
+                        yield block
+            yield b"\r\n"
+        yield self._tail
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        chunks = []
+        while size > 0:
+            if self._offset >= len(self._block):
+                self._block = next(self._blocks, None)
+                self._offset = 0
+                if self._block is None:
+                    self._block = b""
+                    break
+            # slicing the current block instead of copying what is left of it
+            chunk = self._block[self._offset : self._offset + size]
+            self._offset += len(chunk)
+            size -= len(chunk)
+            chunks.append(chunk)
+        data = b"".join(chunks)
+        self.bytes_read += len(data)
+        if self.callback and data:
+            self.callback(self.bytes_read, self.len)
+        return data
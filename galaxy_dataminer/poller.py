@@ -0,0 +1,55 @@
+import logging
+import time
+
+from galaxy_dataminer.metrics import Metrics
+
+DEFAULT_INITIAL = 0.5
+DEFAULT_FACTOR = 2.0
+DEFAULT_MAXIMUM = 60.0
+
+
+class Backoff:
+    # exponential backoff between status checks, shortened when the
+    # reported progress says the job should finish earlier
+    def __init__(
+        self, initial=DEFAULT_INITIAL, factor=DEFAULT_FACTOR, maximum=DEFAULT_MAXIMUM
+    ):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.interval = initial
+
+    def next(self, elapsed=None, percent=None):
+        interval = self.interval
+        self.interval = min(self.interval * self.factor, self.maximum)
+        if elapsed and percent and 0 < percent < 100:
+            remaining = elapsed * (100 - percent) / float(percent)
+            interval = min(interval, max(remaining, self.initial))
+        return interval
+
+
+def monitor_execution(wps, execution, backoff=None, metrics=None):
+    # returns the number of status requests done. The time until DataMiner
+    # reports the job as started is accounted as queued, the rest as running
+    backoff = backoff or Backoff()
+    metrics = metrics or Metrics()
+    start = time.time()
+    queued = None
+    polls = 0
+    while execution.isComplete() is False:
+        if queued is None and execution.status != "ProcessAccepted":
+            queued = time.time() - start
+        time.sleep(backoff.next(time.time() - start, execution.percentCompleted))
+        wps.check_status(execution)
+        polls += 1
+        logging.info(
+            "Execution status: %s (%s%%)", execution.status, execution.percentCompleted
+        )
+    elapsed = time.time() - start
+    if queued is None:
+        queued = elapsed
+    metrics.add_time("queued", queued)
+    metrics.add_time("running", elapsed - queued)
+    metrics.incr("polls", polls)
+    logging.info("Execution completed after %d status polls", polls)
+    return polls
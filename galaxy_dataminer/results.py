@@ -0,0 +1,58 @@
+from lxml import etree
+
+GML_NS = "http://www.opengis.net/gml"
+OGR_NS = "http://ogr.maptools.org/"
+D4SCIENCE_NS = "http://www.d4science.org"
+
+FEATURE_MEMBER = "{%s}featureMember" % GML_NS
+RESULT = "{%s}Result" % OGR_NS
+
+
+def _text(elem, name):
+    child = elem.find("{%s}%s" % (D4SCIENCE_NS, name))
+    return child.text if child is not None else None
+
+
+def iter_results(source):
+    # yields (data, mime_type, description) for each Result of the first
+    # featureMember of a DataMiner output document as soon as it is parsed.
+    # Processed elements are dropped so memory does not grow with the
+    # document. source is a file name or a file-like object.
+    members = 0
+    context = etree.iterparse(
+        source, events=("start", "end"), tag=(FEATURE_MEMBER, RESULT)
+    )
+    for event, elem in context:
+        if elem.tag == FEATURE_MEMBER:
+            if event == "start":
+                members += 1
+            elif members == 1:
+                # nothing else is used from the document
+                break
+            continue
+        if event != "end":
+            continue
+        parent = elem.getparent()
+        if members == 1 and parent is not None and parent.tag == FEATURE_MEMBER:
+            yield (
+                _text(elem, "Data"),
+                _text(elem, "MimeType"),
+                _text(elem, "Description"),
+            )
+        elem.clear()
+        while elem.getprevious() is not None:
+            del parent[0]
+    del context
+
+
+def open_output(out, session, headers=None):
+    # file-like object with the output document, streamed from the WPS when
+    # it is a reference
+    if out.reference:
+        r = session.get(out.reference, stream=True, headers=headers)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return r.raw
+    if out.fileName:
+        return open(out.fileName, "rb")
+    return None
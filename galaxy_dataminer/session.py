@@ -0,0 +1,318 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import threading
+import time
+
+from lxml import etree
+from owslib.wps import ASYNC, WebProcessingService, WPSExecution
+import requests
+from requests.adapters import HTTPAdapter
+import six.moves.urllib.parse as urlparse
+
+from galaxy_dataminer.context import submit
+from galaxy_dataminer.poller import Backoff
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 300)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+
+# only these are sent again after a failure
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+RETRY_STATUS = (429, 500, 502, 503, 504)
+RETRY_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+STATS = ("requests", "failures", "retries", "hedged", "hedge_wins", "rejected")
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    # stops sending requests to a host after threshold consecutive failures,
+    # then lets one through every cooldown seconds to probe whether it is back
+    def __init__(self, host, threshold, cooldown):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.cooldown:
+                self.opened = time.time()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.opened is not None:
+                logging.info("%s is back, closing circuit", self.host)
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                if self.opened is None:
+                    logging.warning(
+                        "%d consecutive failures from %s, opening circuit for %ss",
+                        self.failures,
+                        self.host,
+                        self.cooldown,
+                    )
+                self.opened = time.time()
+
+
+def _close_response(future):
+    if not future.exception():
+        future.result().close()
+
+
+class Session(requests.Session):
+    # requests session with connection pooling and default timeouts, can be
+    # tuned per host (as "host" or "host:port"). Failed idempotent requests
+    # are retried with exponential backoff, hosts failing repeatedly are
+    # given a rest by a circuit breaker, and requests made with hedge=True
+    # are sent a second time if the first one is slower than hedge_delay
+    def __init__(
+        self,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        retries=DEFAULT_RETRIES,
+        retry_delay=DEFAULT_RETRY_DELAY,
+        hedge_delay=None,
+        breaker_threshold=DEFAULT_BREAKER_THRESHOLD,
+        breaker_cooldown=DEFAULT_BREAKER_COOLDOWN,
+    ):
+        super(Session, self).__init__()
+        self.timeout = timeout
+        self.host_timeouts = {}
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.hedge_delay = hedge_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.stats = dict((k, 0) for k in STATS)
+        self._breakers = {}
+        self._hedge_executor = None
+        self._lock = threading.Lock()
+        for scheme in ("http://", "https://"):
+            self.mount(scheme, HTTPAdapter(pool_maxsize=pool_size))
+        self.pool_size = pool_size
+
+    def configure_host(self, host, pool_size=None, timeout=None):
+        if pool_size:
+            for scheme in ("http://", "https://"):
+                self.mount(
+                    "%s%s/" % (scheme, host), HTTPAdapter(pool_maxsize=pool_size)
+                )
+        if timeout:
+            self.host_timeouts[host] = timeout
+
+    def _count(self, stat, value=1):
+        with self._lock:
+            self.stats[stat] += value
+
+    def _breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    host, self.breaker_threshold, self.breaker_cooldown
+                )
+            return self._breakers[host]
+
+    def _send(self, method, url, kwargs):
+        self._count("requests")
+        return super(Session, self).request(method, url, **kwargs)
+
+    def _hedged(self, method, url, kwargs):
+        # first response wins, the other one is closed when it arrives
+        with self._lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=2 * self.pool_size
+                )
+        executor = self._hedge_executor
+        first = submit(executor, self._send, method, url, kwargs)
+        done, _ = wait([first], timeout=self.hedge_delay)
+        if done:
+            return first.result()
+        self._count("hedged")
+        logging.debug("No answer from %s after %ss, hedging", url, self.hedge_delay)
+        second = submit(executor, self._send, method, url, kwargs)
+        pending = set([first, second])
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception():
+                    error = future.exception()
+                    continue
+                for other in pending:
+                    other.add_done_callback(_close_response)
+                if future is second:
+                    self._count("hedge_wins")
+                return future.result()
+        raise error
+
+    def request(self, method, url, **kwargs):
+        hedge = kwargs.pop("hedge", False) and self.hedge_delay
+        host = urlparse.urlparse(url).netloc
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.host_timeouts.get(host, self.timeout)
+        breaker = self._breaker(host)
+        attempts = 1
+        if method.upper() in IDEMPOTENT_METHODS:
+            attempts += self.retries
+        backoff = Backoff(self.retry_delay, maximum=self.retry_delay * 16)
+        for attempt in range(1, attempts + 1):
+            if not breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("Circuit open for %s" % host)
+            try:
+                if hedge:
+                    r = self._hedged(method, url, kwargs)
+                else:
+                    r = self._send(method, url, kwargs)
+            except RETRY_ERRORS as e:
+                breaker.failure()
+                self._count("failures")
+                if attempt == attempts:
+                    raise
+                error = e
+            else:
+                if r.status_code not in RETRY_STATUS:
+                    breaker.success()
+                    return r
+                breaker.failure()
+                self._count("failures")
+                if attempt == attempts:
+                    return r
+                error = "HTTP %d" % r.status_code
+                r.close()
+            self._count("retries")
+            logging.warning(
+                "%s %s failed (%s), retrying (%d of %d)",
+                method,
+                url,
+                error,
+                attempt,
+                attempts - 1,
+            )
+            time.sleep(backoff.next())
+
+    def log_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        level = logging.WARNING if stats["failures"] else logging.INFO
+        logging.log(
+            level,
+            "HTTP: %(requests)d requests, %(failures)d failures, %(retries)d "
+            "retries, %(hedged)d hedged (%(hedge_wins)d won by the duplicate), "
+            "%(rejected)d rejected by open circuits",
+            stats,
+        )
+        return stats
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        super(Session, self).close()
+
+
+def parse_host_option(value):
+    # HOST=POOL_SIZE[,TIMEOUT]
+    host, settings = value.split("=", 1)
+    pool_size, _, timeout = settings.partition(",")
+    return (
+        host,
+        int(pool_size) if pool_size else None,
+        float(timeout) if timeout else None,
+    )
+
+
+def build_session(pool_size=DEFAULT_POOL_SIZE, timeout=None, hosts=None, **kwargs):
+    # kwargs are the retry, hedging and circuit breaker settings of Session
+    session = Session(pool_size, timeout or DEFAULT_TIMEOUT, **kwargs)
+    for host in hosts or []:
+        host, host_pool_size, host_timeout = parse_host_option(host)
+        session.configure_host(host, host_pool_size, host_timeout)
+    return session
+
+
+class SessionWPS(WebProcessingService):
+    # owslib does all its requests with plain requests calls, this fetches
+    # the documents with our session and hands the XML over to owslib
+    def __init__(self, url, session, **kwargs):
+        self.session = session
+        super(SessionWPS, self).__init__(url, **kwargs)
+
+    def _get(self, url, params=None):
+        r = self.session.get(url, params=params, headers=self.headers)
+        r.raise_for_status()
+        return r.content
+
+    def getcapabilities(self, xml=None):
+        if xml is None:
+            params = {
+                "service": "WPS",
+                "request": "GetCapabilities",
+                "version": self.version,
+            }
+            xml = self._get(self.url, params)
+        super(SessionWPS, self).getcapabilities(xml=xml)
+
+    def describeprocess_xml(self, identifier):
+        params = {
+            "service": "WPS",
+            "request": "DescribeProcess",
+            "version": self.version,
+            "identifier": identifier,
+        }
+        return self._get(self.url, params)
+
+    def describeprocess(self, identifier, xml=None):
+        if xml is None:
+            xml = self.describeprocess_xml(identifier)
+        return super(SessionWPS, self).describeprocess(identifier, xml=xml)
+
+    def execute(
+        self,
+        identifier,
+        inputs,
+        output=None,
+        mode=ASYNC,
+        lineage=False,
+        request=None,
+        response=None,
+    ):
+        if request is None:
+            builder = WPSExecution(version=self.version)
+            request = etree.tostring(
+                builder.buildRequest(identifier, inputs, output, mode, lineage)
+            )
+        if response is None:
+            headers = dict(self.headers or {})
+            headers["Content-Type"] = "text/xml"
+            r = self.session.post(self.url, data=request, headers=headers)
+            r.raise_for_status()
+            response = r.content
+        execution = super(SessionWPS, self).execute(
+            identifier, inputs, output, mode, lineage, request, response
+        )
+        execution.request = request
+        return execution
+
+    def check_status(self, execution, sleepSecs=0):
+        xml = self._get(execution.statusLocation)
+        execution.checkStatus(response=xml, sleepSecs=sleepSecs)
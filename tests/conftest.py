@@ -0,0 +1,57 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+
+import pytest
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self):
+        server = self.server
+        with server.lock:
+            server.calls.append((self.command, self.path))
+        route = server.routes.get(self.path.split("?")[0])
+        if route is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        route(self)
+
+    do_GET = do_HEAD = do_POST = _dispatch
+
+    def reply(self, status=200, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients giving up on slow answers are expected
+        pass
+
+
+@pytest.fixture
+def server():
+    # local HTTP server, tests add handlers to server.routes by path
+    httpd = Server(("127.0.0.1", 0), Handler)
+    httpd.routes = {}
+    httpd.calls = []
+    httpd.lock = threading.Lock()
+    httpd.url = "http://127.0.0.1:%d" % httpd.server_port
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,118 @@
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+from owslib.wps import WPSExecution
+import pytest
+
+from galaxy_dataminer import agent
+from galaxy_dataminer.agent import wait_execution
+from galaxy_dataminer.metrics import Metrics
+from galaxy_dataminer.poller import Backoff
+
+SUCCEEDED = """<?xml version="1.0" encoding="UTF-8"?>
+<wps:ExecuteResponse xmlns:wps="http://www.opengis.net/wps/1.0.0"
+ xmlns:ows="http://www.opengis.net/ows/1.1" service="WPS" version="1.0.0"
+ statusLocation="http://wps/status?id=1">
+<wps:Process><ows:Identifier>p</ows:Identifier><ows:Title>P</ows:Title></wps:Process>
+<wps:Status creationTime="2020-01-01T00:00:00Z">
+<wps:ProcessSucceeded>Done</wps:ProcessSucceeded></wps:Status>
+</wps:ExecuteResponse>"""
+
+
+def fake_agent(path, lines):
+    # answers every client with lines, None means never answering
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+
+    def run():
+        conn, _ = server.accept()
+        conn.makefile("rb").readline()
+        for line in lines:
+            if line is None:
+                time.sleep(5)
+                break
+            conn.sendall(line + b"\n")
+        conn.close()
+        server.close()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+
+def execution():
+    e = WPSExecution()
+    e.status = "ProcessStarted"
+    e.statusLocation = "http://wps/status?id=1"
+    return e
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.setattr(agent, "HEARTBEAT", 0.1)
+    return str(tmp_path / "agent.sock")
+
+
+def test_completed_execution(path):
+    reply = {
+        "status": "ProcessSucceeded",
+        "response": SUCCEEDED,
+        "metrics": Metrics().to_dict(),
+    }
+    heartbeat = b'{"heartbeat": true}'
+    fake_agent(path, [heartbeat, heartbeat, json.dumps(reply).encode("utf-8")])
+    e = execution()
+    assert wait_execution(path, e, {"gcube-token": b"tok"}, Backoff())
+    assert e.status == "ProcessSucceeded"
+
+
+def test_no_agent(path):
+    assert not wait_execution(path, execution(), {}, Backoff())
+
+
+def test_stuck_agent(path):
+    fake_agent(path, [None])
+    start = time.time()
+    assert not wait_execution(path, execution(), {}, Backoff())
+    assert time.time() - start < 2
+
+
+@pytest.mark.parametrize(
+    "line", [b"not json", b"[]", b'{"status": "ProcessSucceeded"}', b""]
+)
+def test_bad_answers(path, line):
+    fake_agent(path, [line] if line else [])
+    assert not wait_execution(path, execution(), {}, Backoff())
+
+
+def test_agent_error(path):
+    fake_agent(path, [b'{"error": "Agent is shutting down"}'])
+    assert not wait_execution(path, execution(), {}, Backoff())
+
+
+def test_socket_only_for_its_user(tmp_path):
+    path = str(tmp_path / "agent.sock")
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "galaxy_dataminer.agent", "--socket", path],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+        assert mode & 0o077 == 0
+    finally:
+        proc.terminate()
+        proc.wait()
+    assert not os.path.exists(path)
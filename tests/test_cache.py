@@ -0,0 +1,56 @@
+import json
+import multiprocessing
+import os
+import time
+
+from galaxy_dataminer.cache import TTLCache
+
+
+def test_get_set(tmp_path):
+    cache = TTLCache(str(tmp_path / "sub" / "c.json"), 60)
+    assert cache.get("a") is None
+    cache.set("a", {"x": 1})
+    assert TTLCache(cache.path, 60).get("a") == {"x": 1}
+    cache.invalidate("a")
+    assert cache.get("a") is None
+
+
+def test_expired_entries(tmp_path):
+    cache = TTLCache(str(tmp_path / "c.json"), 0.1)
+    cache.set("old", 1)
+    time.sleep(0.15)
+    assert cache.get("old") is None
+    cache.set("new", 2)
+    with open(cache.path) as f:
+        assert list(json.load(f)) == ["new"]
+
+
+def test_broken_file(tmp_path):
+    path = str(tmp_path / "c.json")
+    with open(path, "w") as f:
+        f.write("{not json")
+    cache = TTLCache(path, 60)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+
+
+def add_entries(path, prefix):
+    cache = TTLCache(path, 60)
+    for i in range(20):
+        cache.set("%s%d" % (prefix, i), i)
+
+
+def test_concurrent_processes(tmp_path):
+    # no process loses the entries of the others
+    path = str(tmp_path / "c.json")
+    procs = [
+        multiprocessing.Process(target=add_entries, args=(path, p)) for p in "abcd"
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    with open(path) as f:
+        assert len(json.load(f)) == 80
+    assert os.path.exists(path + ".lock")
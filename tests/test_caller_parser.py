@@ -0,0 +1,79 @@
+import json
+
+from galaxy_dataminer.caller_parser import (
+    SNIFF_SIZE,
+    find_dataminer_data,
+    read_dataminer_data,
+    sniff_html,
+)
+
+OUTPUTS = {"outputs": [{"descriptor": "Result", "url": "http://x/r.csv"}]}
+
+
+def html_file(tmp_path, body, name="out.html"):
+    path = tmp_path / name
+    path.write_bytes(body)
+    return str(path)
+
+
+def produced(tmp_path, data=OUTPUTS, padding=0):
+    # the layout produce_output writes
+    return html_file(
+        tmp_path,
+        (
+            "<html><body><h2>Timings:</h2>%s"
+            '<script type="application/json" id="dataminer-output">%s</script>'
+            "</body></html>" % ("<p>x</p>" * padding, json.dumps(data))
+        ).encode("utf-8"),
+    )
+
+
+def test_sniff_html(tmp_path):
+    assert sniff_html(html_file(tmp_path, b"<html><body>")) is True
+    assert sniff_html(html_file(tmp_path, b"\xef\xbb\xbf\n<!DOCTYPE HTML>")) is True
+    assert sniff_html(html_file(tmp_path, b"a,b\n1,2\n")) is False
+    assert sniff_html(html_file(tmp_path, b"")) is False
+    # XML or HTML without a doctype, left to libmagic
+    assert sniff_html(html_file(tmp_path, b'<?xml version="1.0"?>')) is None
+    assert sniff_html(html_file(tmp_path, b" " * SNIFF_SIZE + b"<html>")) is False
+
+
+def test_find_dataminer_data(tmp_path):
+    assert find_dataminer_data(produced(tmp_path)) == OUTPUTS
+    assert find_dataminer_data(produced(tmp_path, padding=100000)) == OUTPUTS
+    assert find_dataminer_data(html_file(tmp_path, b"")) is None
+    assert find_dataminer_data(html_file(tmp_path, b"<html></html>")) is None
+    broken = b'<script id="dataminer-output">{"outputs": [</script>'
+    assert find_dataminer_data(html_file(tmp_path, broken)) is None
+    unclosed = b'<script id="dataminer-output">{}'
+    assert find_dataminer_data(html_file(tmp_path, unclosed)) is None
+
+
+def test_find_last_script(tmp_path):
+    # an output embedding the page of another execution comes before the
+    # script of this one
+    other = {"outputs": []}
+    path = html_file(
+        tmp_path,
+        (
+            '<html><script id="dataminer-output">%s</script>'
+            '<script type="application/json" id="dataminer-output">%s</script>'
+            "</html>" % (json.dumps(other), json.dumps(OUTPUTS))
+        ).encode("utf-8"),
+    )
+    assert find_dataminer_data(path) == OUTPUTS
+
+
+def test_read_dataminer_data_fallback(tmp_path):
+    assert read_dataminer_data(produced(tmp_path)) == OUTPUTS
+    # attributes in another order, not found by the fast path
+    path = html_file(
+        tmp_path,
+        (
+            "<html><body><script id='dataminer-output' type='application/json'>"
+            "%s</script></body></html>" % json.dumps(OUTPUTS)
+        ).encode("utf-8"),
+    )
+    assert find_dataminer_data(path) is None
+    assert read_dataminer_data(path) == OUTPUTS
+    assert read_dataminer_data(html_file(tmp_path, b"<html></html>")) is None
@@ -0,0 +1,116 @@
+import hashlib
+import os
+
+import pytest
+
+from galaxy_dataminer import download as download_module
+from galaxy_dataminer.download import download, PART_SUFFIX
+from galaxy_dataminer.session import build_session
+
+DATA = os.urandom(300000)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def serve_data(cut=None, ranges=True):
+    # route with DATA, the first answers stop after cut bytes
+    cuts = list(cut or [])
+
+    def route(handler):
+        start = 0
+        status = 200
+        headers = {}
+        rng = handler.headers.get("Range")
+        if rng and ranges:
+            start = int(rng.split("=")[1].split("-")[0])
+            if start >= len(DATA):
+                return handler.reply(416)
+            status = 206
+            headers["Content-Range"] = "bytes %d-%d/%d" % (
+                start,
+                len(DATA) - 1,
+                len(DATA),
+            )
+        body = DATA[start:]
+        handler.send_response(status)
+        for k, v in headers.items():
+            handler.send_header(k, v)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if cuts:
+            handler.wfile.write(body[: cuts.pop(0)])
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.wfile.write(body)
+
+    return route
+
+
+@pytest.fixture
+def session():
+    return build_session(retries=0)
+
+
+def test_download(server, tmp_path, session):
+    server.routes["/data"] = serve_data()
+    path = str(tmp_path / "out")
+    assert download(server.url + "/data", path, session=session) == (
+        len(DATA),
+        SHA256,
+    )
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + PART_SUFFIX)
+
+
+def test_resumes_interrupted_download(server, tmp_path, session):
+    server.routes["/data"] = serve_data(cut=[100000, 50000])
+    path = str(tmp_path / "out")
+    assert download(server.url + "/data", path, session=session) == (
+        len(DATA),
+        SHA256,
+    )
+    ranges = [c for c in server.calls if c[1] == "/data"]
+    assert len(ranges) == 3
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_resumes_existing_part(server, tmp_path, session):
+    server.routes["/data"] = serve_data()
+    path = str(tmp_path / "out")
+    with open(path + PART_SUFFIX, "wb") as f:
+        f.write(DATA[:1234])
+    # the digest covers the part written by the previous attempt
+    assert download(server.url + "/data", path, session=session)[1] == SHA256
+
+
+def test_server_ignoring_ranges(server, tmp_path, session):
+    server.routes["/data"] = serve_data(ranges=False)
+    path = str(tmp_path / "out")
+    with open(path + PART_SUFFIX, "wb") as f:
+        f.write(b"stale")
+    assert download(server.url + "/data", path, session=session)[1] == SHA256
+
+
+def test_part_larger_than_remote(server, tmp_path, session):
+    server.routes["/data"] = serve_data()
+    path = str(tmp_path / "out")
+    with open(path + PART_SUFFIX, "wb") as f:
+        f.write(DATA + b"more")
+    assert download(server.url + "/data", path, session=session)[1] == SHA256
+
+
+def test_gives_up(server, tmp_path, session, monkeypatch):
+    monkeypatch.setattr(download_module, "MAX_RESUMES", 2)
+    server.routes["/data"] = serve_data(cut=[10, 10, 10, 10])
+    path = str(tmp_path / "out")
+    with pytest.raises(Exception, match="Cannot download"):
+        download(server.url + "/data", path, session=session)
+    assert not os.path.exists(path)
+
+
+def test_http_errors(server, tmp_path, session):
+    path = str(tmp_path / "out")
+    with pytest.raises(Exception):
+        download(server.url + "/missing", path, session=session)
@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+
+import pytest
+
+from galaxy_dataminer import extract
+from galaxy_dataminer.extract import copy_output
+from galaxy_dataminer.manifest import write_manifest
+
+DATA = os.urandom(200000)
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = str(tmp_path / "src")
+    with open(path, "wb") as f:
+        f.write(DATA)
+    return path
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def no_reflink(fsrc, fdst):
+    raise OSError("no reflink here")
+
+
+def test_copy(src, tmp_path):
+    dst = str(tmp_path / "dst")
+    assert copy_output(src, dst) != "hardlink"
+    assert read(dst) == DATA
+    assert os.stat(dst).st_nlink == 1
+
+
+def test_hardlink(src, tmp_path):
+    dst = str(tmp_path / "dst")
+    assert copy_output(src, dst, True) == "hardlink"
+    assert os.stat(dst).st_nlink == 2
+
+
+def test_short_copy_falls_back(src, tmp_path, monkeypatch):
+    # kernel copies stopping early must not leave a truncated file
+    monkeypatch.setattr(extract, "_reflink", no_reflink)
+    copied = []
+
+    def short_copy_file_range(fd_in, fd_out, count):
+        if copied:
+            return 0
+        copied.append(count)
+        return os.write(fd_out, os.read(fd_in, 1000))
+
+    def short_sendfile(fd_out, fd_in, offset, count):
+        return 0
+
+    monkeypatch.setattr(os, "copy_file_range", short_copy_file_range, raising=False)
+    monkeypatch.setattr(os, "sendfile", short_sendfile, raising=False)
+    dst = str(tmp_path / "dst")
+    assert copy_output(src, dst) == "copy"
+    assert read(dst) == DATA
+
+
+def test_copy_replaces_longer_file(src, tmp_path, monkeypatch):
+    monkeypatch.setattr(extract, "_reflink", no_reflink)
+    dst = str(tmp_path / "dst")
+    with open(dst, "wb") as f:
+        f.write(DATA * 2)
+    copy_output(src, dst)
+    assert read(dst) == DATA
+
+
+OUTPUTS = [
+    {
+        "descriptor": "Log of the computation",
+        "mime_type": "text/csv",
+        "name": "log.csv",
+    },
+    {"descriptor": "Result", "mime_type": "text/csv", "name": "result.csv"},
+    {"descriptor": "Map", "mime_type": "image/png", "name": "map.png"},
+]
+
+
+@pytest.fixture
+def inputdir(tmp_path):
+    path = tmp_path / "dataset_1_files"
+    path.mkdir()
+    for out in OUTPUTS:
+        (path / out["name"]).write_bytes(out["name"].encode("utf-8"))
+    html = tmp_path / "dataset_1.dat"
+    html.write_text(
+        '<html><script type="application/json" id="dataminer-output">%s'
+        "</script></html>" % json.dumps({"outputs": OUTPUTS})
+    )
+    return path
+
+
+def wps_extract(monkeypatch, inputdir, *args):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["wps_extract", "--inputdata", str(inputdir.parent / "dataset_1.dat")]
+        + ["--inputdir", str(inputdir)]
+        + list(args),
+    )
+    extract.main()
+
+
+@pytest.mark.parametrize("manifest", [True, False])
+def test_wps_extract(tmp_path, monkeypatch, inputdir, manifest):
+    if manifest:
+        write_manifest(str(inputdir), OUTPUTS)
+    out = [str(tmp_path / ("out%d" % i)) for i in range(3)]
+    wps_extract(
+        monkeypatch,
+        inputdir,
+        *["--descriptor", "Map", "--output", out[0]]
+        + ["--descriptor", "", "--output", out[1]]
+        + ["--descriptor", "Log of the computation", "--output", out[2]]
+    )
+    assert [read(o) for o in out] == [b"map.png", b"result.csv", b"log.csv"]
+
+
+def test_wps_extract_missing_output(tmp_path, monkeypatch, inputdir):
+    write_manifest(str(inputdir), OUTPUTS)
+    out = tmp_path / "out"
+    with pytest.raises(Exception, match="Output not found"):
+        wps_extract(
+            monkeypatch,
+            inputdir,
+            *["--descriptor", "Result", "--output", str(out)]
+            + ["--descriptor", "Other", "--output", str(tmp_path / "other")]
+        )
+    # nothing is copied unless all of them are there
+    assert not out.exists()
+
+
+def test_wps_extract_size_mismatch(tmp_path, monkeypatch, inputdir):
+    write_manifest(str(inputdir), [dict(OUTPUTS[1], size=len(OUTPUTS[1]["name"]) + 1)])
+    with pytest.raises(Exception, match="expected"):
+        wps_extract(
+            monkeypatch,
+            inputdir,
+            *["--descriptor", "Result", "--output", str(tmp_path / "out")]
+        )
@@ -0,0 +1,74 @@
+from io import BytesIO
+import json
+import os
+
+from lxml import etree
+
+from galaxy_dataminer.generator import (
+    find_section,
+    remove_stale_tools,
+    TOOLS_STATE,
+    write_config,
+)
+
+
+def touch(tool_dir, *names):
+    for name in names:
+        with open(os.path.join(tool_dir, name), "w") as f:
+            f.write("<tool/>")
+
+
+def test_removes_tools_no_longer_generated(tmp_path):
+    tool_dir = str(tmp_path)
+    touch(tool_dir, "a.xml", "b.xml", "extract.xml", "mine.xml")
+    assert remove_stale_tools(tool_dir, tool_dir, ["a.xml", "b.xml"]) == []
+    assert remove_stale_tools(tool_dir, tool_dir, [tool_dir + "/a.xml"]) == ["b.xml"]
+    # only files it generated itself are removed
+    assert sorted(os.listdir(tool_dir)) == [
+        "a.xml",
+        "extract.xml",
+        "mine.xml",
+        TOOLS_STATE,
+    ]
+    with open(os.path.join(tool_dir, TOOLS_STATE)) as f:
+        assert json.load(f) == ["a.xml"]
+
+
+def test_removes_legacy_tools_once(tmp_path):
+    tool_dir = str(tmp_path)
+    touch(tool_dir, "tool00.xml", "tool01.xml", "tool123.xml", "toolbox.xml", "a.xml")
+    removed = remove_stale_tools(tool_dir, tool_dir, ["a.xml"])
+    assert sorted(removed) == ["tool00.xml", "tool01.xml", "tool123.xml"]
+    touch(tool_dir, "tool02.xml")
+    assert remove_stale_tools(tool_dir, tool_dir, ["a.xml"]) == []
+    assert os.path.exists(os.path.join(tool_dir, "tool02.xml"))
+
+
+def test_missing_tool_files_are_not_an_error(tmp_path):
+    tool_dir = str(tmp_path)
+    remove_stale_tools(tool_dir, tool_dir, ["a.xml", "b.xml"])
+    assert remove_stale_tools(tool_dir, tool_dir, []) == []
+
+
+CONFIG = b"""<?xml version="1.0"?>
+<toolbox tool_path="tools">
+<!-- local tools -->
+<section id="local" name="Local"><tool file="local.xml"/></section>
+<section id="d4science" name="DataMiner"><tool file="old.xml"/></section>
+</toolbox>"""
+
+
+def test_write_config_keeps_other_sections():
+    parser = etree.XMLParser(remove_blank_text=True)
+    config = etree.ElementTree(etree.fromstring(CONFIG, parser))
+    section = find_section(config, "d4science")
+    etree.SubElement(section, "tool", attrib={"file": "new.xml"})
+    data = BytesIO()
+    write_config(config.getroot(), data)
+    root = etree.fromstring(data.getvalue())
+    assert [s.get("id") for s in root.findall("section")] == ["local", "d4science"]
+    assert [t.get("file") for t in root.find("section[@id='d4science']")] == ["new.xml"]
+    # same config, same bytes
+    again = BytesIO()
+    write_config(etree.fromstring(data.getvalue(), parser), again)
+    assert again.getvalue() == data.getvalue()
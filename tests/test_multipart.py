@@ -0,0 +1,86 @@
+import os
+
+import requests
+
+from galaxy_dataminer import multipart
+from galaxy_dataminer.multipart import MultipartEncoder
+
+
+def fields(tmp_path, size):
+    path = os.path.join(str(tmp_path), "in.csv")
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path, [
+        ("name", "data-1"),
+        ("file", ("in.csv", path)),
+        ("description", 'Input "data" for DataMiner'),
+    ]
+
+
+def requests_body(path, boundary, monkeypatch):
+    # what requests sends for the same fields given as files=
+    monkeypatch.setattr("urllib3.filepost.choose_boundary", lambda: boundary)
+    with open(path, "rb") as f:
+        files = [
+            ("name", "data-1"),
+            ("file", ("in.csv", f)),
+            ("description", 'Input "data" for DataMiner'),
+        ]
+        r = requests.Request("POST", "http://localhost/", files=files).prepare()
+    return r.body, r.headers["Content-Type"]
+
+
+def test_same_body_as_requests(tmp_path, monkeypatch):
+    path, f = fields(tmp_path, 3000)
+    body = MultipartEncoder(f, boundary="b0undary")
+    expected, content_type = requests_body(path, "b0undary", monkeypatch)
+    assert body.content_type == content_type
+    data = body.read()
+    assert data == expected
+    assert len(body) == len(expected)
+
+
+def test_small_reads_across_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(multipart, "BLOCK_SIZE", 1000)
+    path, f = fields(tmp_path, 4500)
+    expected = MultipartEncoder(f, boundary="b").read()
+    body = MultipartEncoder(f, boundary="b")
+    chunks = []
+    while True:
+        chunk = body.read(333)
+        if not chunk:
+            break
+        assert len(chunk) <= 333
+        chunks.append(chunk)
+    assert b"".join(chunks) == expected
+    assert body.read(10) == b""
+
+
+def test_callback_reports_progress(tmp_path):
+    path, f = fields(tmp_path, 10000)
+    progress = []
+    body = MultipartEncoder(f, lambda done, total: progress.append((done, total)))
+    while body.read(4096):
+        pass
+    assert progress[-1] == (len(body), len(body))
+    assert [done for done, _ in progress] == sorted(done for done, _ in progress)
+
+
+def test_streamed_upload(server, tmp_path):
+    received = {}
+
+    def route(handler):
+        length = int(handler.headers["Content-Length"])
+        received["body"] = handler.rfile.read(length)
+        received["type"] = handler.headers["Content-Type"]
+        handler.reply(200, b"id")
+
+    server.routes["/upload"] = route
+    path, f = fields(tmp_path, 200000)
+    body = MultipartEncoder(f)
+    r = requests.post(
+        server.url + "/upload", data=body, headers={"Content-Type": body.content_type}
+    )
+    assert r.text == "id"
+    assert received["type"] == body.content_type
+    assert received["body"] == MultipartEncoder(f, boundary=body.boundary).read()
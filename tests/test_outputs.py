@@ -0,0 +1,62 @@
+import json
+import os
+from types import SimpleNamespace
+
+from galaxy_dataminer.caller import produce_output
+from galaxy_dataminer.manifest import MANIFEST_FILE
+from galaxy_dataminer.session import build_session
+
+DOCUMENT = """<ogr:FeatureCollection xmlns:ogr="http://ogr.maptools.org/"
+ xmlns:gml="http://www.opengis.net/gml" xmlns:d4science="http://www.d4science.org">
+<gml:featureMember>%s</gml:featureMember></ogr:FeatureCollection>"""
+
+RESULT = """<ogr:Result fid="F%(i)d">
+<d4science:Data>%(url)s/data/%(i)d</d4science:Data>
+<d4science:Description>%(desc)s</d4science:Description>
+<d4science:MimeType>text/csv</d4science:MimeType></ogr:Result>"""
+
+
+def execution(url):
+    out = SimpleNamespace(reference=url + "/output", fileName=None)
+    return SimpleNamespace(
+        status="ProcessSucceeded",
+        processOutputs=[out],
+        process=SimpleNamespace(title="Test"),
+        statusLocation=url + "/status?id=1",
+        errors=[],
+    )
+
+
+def test_repeated_descriptions_get_their_own_files(server, tmp_path):
+    descriptions = ["Table", "Table", "Log of the computation", "Table"]
+    doc = DOCUMENT % "".join(
+        RESULT % {"i": i, "url": server.url, "desc": d}
+        for i, d in enumerate(descriptions)
+    )
+    server.routes["/output"] = lambda h: h.reply(200, doc.encode("utf-8"))
+    for i in range(len(descriptions)):
+        body = ("%d," % i).encode("utf-8") * 10000
+        server.routes["/data/%d" % i] = lambda h, body=body: h.reply(200, body)
+    outdir = str(tmp_path / "out")
+    os.makedirs(outdir)
+    output_dict = produce_output(
+        execution(server.url),
+        str(tmp_path / "out.html"),
+        outdir,
+        {},
+        jobs=4,
+        session=build_session(),
+    )
+    names = [o["name"] for o in output_dict["outputs"]]
+    assert names == [
+        "Table.csv",
+        "Table (2).csv",
+        "Log of the computation.csv",
+        "Table (3).csv",
+    ]
+    for i, name in enumerate(names):
+        with open(os.path.join(outdir, name), "rb") as f:
+            assert f.read() == ("%d," % i).encode("utf-8") * 10000
+    with open(os.path.join(outdir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    assert manifest["outputs"]["Log of the computation"]["name"] == names[2]
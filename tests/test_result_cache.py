@@ -0,0 +1,96 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+from galaxy_dataminer.cache import RESULT_FILE, ResultCache
+from galaxy_dataminer.caller import result_key
+
+
+def output(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), 1024, 60)
+    assert cache.get("k") is None
+    src = output(tmp_path, "out.csv", b"a,b\n")
+    cache.put("k", {"exit": 0}, [src])
+    path, result = cache.get("k")
+    assert result == {"exit": 0}
+    with open(os.path.join(path, "out.csv"), "rb") as f:
+        assert f.read() == b"a,b\n"
+    # a copy, the dataset in the outdir is left alone
+    assert not os.path.samefile(src, os.path.join(path, "out.csv"))
+    cache.put("k", {"exit": 1}, [])
+    path, result = cache.get("k")
+    assert result == {"exit": 1}
+    assert os.listdir(path) == [RESULT_FILE]
+
+
+def test_expired(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024, 0.1)
+    cache.put("k", None, [])
+    time.sleep(0.15)
+    assert cache.get("k") is None
+
+
+def test_prune_expired_and_interrupted(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024, 60)
+    cache.put("fresh", None, [])
+    cache.put("old", None, [])
+    with open(os.path.join(cache.cache_dir, "old", RESULT_FILE), "w") as f:
+        json.dump({"created": time.time() - 120, "result": None}, f)
+    broken = os.path.join(cache.cache_dir, "broken")
+    os.mkdir(broken)
+    with open(os.path.join(broken, RESULT_FILE), "w") as f:
+        f.write("{")
+    tmp_old = os.path.join(cache.cache_dir, ".tmp-old")
+    tmp_new = os.path.join(cache.cache_dir, ".tmp-new")
+    os.mkdir(tmp_old)
+    os.mkdir(tmp_new)
+    os.utime(tmp_old, (time.time() - 120, time.time() - 120))
+    cache.prune()
+    # a put in progress is kept
+    assert sorted(os.listdir(cache.cache_dir)) == [".tmp-new", "fresh"]
+
+
+def test_prune_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), 10000, 60)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, None, [output(tmp_path, "out%d" % i, b"x" * 1000)])
+        used = time.time() - 30 + i
+        os.utime(os.path.join(cache.cache_dir, key, RESULT_FILE), (used, used))
+    assert cache.get("a") is not None
+    cache.max_size = 2500
+    cache.prune()
+    assert sorted(os.listdir(cache.cache_dir)) == ["a", "c"]
+
+
+def process(identifier="p", version="1.0", inputs=("text", "data")):
+    return SimpleNamespace(
+        identifier=identifier,
+        processVersion=version,
+        dataInputs=[SimpleNamespace(identifier=i) for i in inputs],
+    )
+
+
+def test_result_key(tmp_path):
+    data = output(tmp_path, "in.csv", b"1,2\n")
+    key = result_key(process(), ["text=a__gt__b"], ["data=" + data], "tok")
+    # the order of the arguments and unknown inputs do not matter
+    assert key == result_key(
+        process(), ["other=x", "text=a>b"], ["data=" + data], "tok"
+    )
+    assert key != result_key(process(), ["text=a"], ["data=" + data], "tok")
+    assert key != result_key(process(), ["text=a>b"], ["data=" + data], "other")
+    assert key != result_key(
+        process(version="1.1"), ["text=a>b"], ["data=" + data], "tok"
+    )
+    # the content of the dataset, not its path
+    copy = output(tmp_path, "copy.csv", b"1,2\n")
+    assert key == result_key(process(), ["text=a>b"], ["data=" + copy], "tok")
+    changed = output(tmp_path, "changed.csv", b"1,3\n")
+    assert key != result_key(process(), ["text=a>b"], ["data=" + changed], "tok")
@@ -0,0 +1,68 @@
+from io import BytesIO
+
+from galaxy_dataminer.results import iter_results
+
+DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<ogr:FeatureCollection xmlns:ogr="http://ogr.maptools.org/"
+ xmlns:gml="http://www.opengis.net/gml" xmlns:d4science="http://www.d4science.org">
+<gml:featureMember>
+%s
+</gml:featureMember>
+<gml:featureMember>
+<ogr:Result fid="X"><d4science:Data>http://other</d4science:Data></ogr:Result>
+</gml:featureMember>
+</ogr:FeatureCollection>"""
+
+RESULT = b"""<ogr:Result fid="F%d">
+<d4science:Data>http://data/%d</d4science:Data>
+<d4science:Description>Output %d</d4science:Description>
+<d4science:MimeType>text/csv</d4science:MimeType>
+</ogr:Result>"""
+
+
+def document(n):
+    return DOCUMENT % b"".join(RESULT % (i, i, i) for i in range(n))
+
+
+def test_results_of_first_member_in_order():
+    results = list(iter_results(BytesIO(document(3))))
+    assert results == [
+        ("http://data/%d" % i, "text/csv", "Output %d" % i) for i in range(3)
+    ]
+
+
+def test_missing_fields():
+    doc = (
+        DOCUMENT
+        % b'<ogr:Result fid="F0"><d4science:Data>u</d4science:Data></ogr:Result>'
+    )
+    assert list(iter_results(BytesIO(doc))) == [("u", None, None)]
+
+
+def test_no_results():
+    assert list(iter_results(BytesIO(DOCUMENT % b""))) == []
+
+
+def test_file_name(tmp_path):
+    path = tmp_path / "out.gml"
+    path.write_bytes(document(2))
+    assert len(list(iter_results(str(path)))) == 2
+
+
+def test_yields_while_parsing():
+    # results come out before the rest of the document is read
+    class Source:
+        def __init__(self, data):
+            self.data = BytesIO(data)
+            self.read_bytes = 0
+
+        def read(self, size=-1):
+            chunk = self.data.read(min(size, 256) if size > 0 else 256)
+            self.read_bytes += len(chunk)
+            return chunk
+
+    data = document(200)
+    source = Source(data)
+    results = iter_results(source)
+    next(results)
+    assert source.read_bytes < len(data)
@@ -0,0 +1,184 @@
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+from galaxy_dataminer.session import build_session, CircuitBreaker, CircuitOpenError
+
+
+def session(**kwargs):
+    s = build_session(**kwargs)
+    s.retry_delay = 0.01
+    return s
+
+
+def failing(times, status=503):
+    # route answering status the first times, then 200
+    count = [0]
+
+    def route(handler):
+        count[0] += 1
+        handler.reply(status if count[0] <= times else 200, b"ok")
+
+    return route
+
+
+def test_retries_idempotent_requests(server):
+    server.routes["/flaky"] = failing(2)
+    s = session(retries=3)
+    r = s.get(server.url + "/flaky")
+    assert r.status_code == 200
+    assert len(server.calls) == 3
+    assert s.stats["retries"] == 2
+    assert s.stats["failures"] == 2
+
+
+def test_gives_up_after_retries(server):
+    server.routes["/down"] = failing(100, 500)
+    s = session(retries=2, breaker_threshold=0)
+    assert s.get(server.url + "/down").status_code == 500
+    assert len(server.calls) == 3
+
+
+def test_does_not_retry_post(server):
+    server.routes["/flaky"] = failing(1)
+    s = session(retries=3)
+    assert s.post(server.url + "/flaky").status_code == 503
+    assert len(server.calls) == 1
+
+
+def test_does_not_retry_client_errors(server):
+    server.routes["/missing"] = failing(1, 404)
+    s = session(retries=3)
+    assert s.get(server.url + "/missing").status_code == 404
+    assert len(server.calls) == 1
+
+
+def test_retries_connection_errors():
+    # nothing listens on the port of a closed socket
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    url = "http://127.0.0.1:%d/" % sock.getsockname()[1]
+    sock.close()
+    s = session(retries=2, breaker_threshold=0)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        s.get(url)
+    assert s.stats["requests"] == 3
+    assert s.stats["failures"] == 3
+
+
+def test_breaker_opens_and_recovers(server):
+    healthy = [False]
+
+    def route(handler):
+        handler.reply(200 if healthy[0] else 503)
+
+    server.routes["/svc"] = route
+    s = session(retries=0, breaker_threshold=2, breaker_cooldown=0.2)
+    s.get(server.url + "/svc")
+    s.get(server.url + "/svc")
+    with pytest.raises(CircuitOpenError):
+        s.get(server.url + "/svc")
+    assert len(server.calls) == 2
+    assert s.stats["rejected"] == 1
+    time.sleep(0.25)
+    healthy[0] = True
+    assert s.get(server.url + "/svc").status_code == 200
+    assert s.get(server.url + "/svc").status_code == 200
+
+
+def test_breaker_lets_one_probe_through_per_cooldown():
+    breaker = CircuitBreaker("host", 1, 0.2)
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.25)
+    # half open: one probe, the others wait for the next cooldown
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.25)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_breaker_counts_consecutive_failures():
+    breaker = CircuitBreaker("host", 2, 10)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+
+def test_hedged_duplicate_wins(server):
+    count = [0]
+    lock = threading.Lock()
+
+    def route(handler):
+        with lock:
+            count[0] += 1
+            first = count[0] == 1
+        if first:
+            time.sleep(1.0)
+        handler.reply(200, b"first" if first else b"second")
+
+    server.routes["/slow"] = route
+    s = session(hedge_delay=0.1)
+    start = time.time()
+    r = s.get(server.url + "/slow", hedge=True)
+    assert time.time() - start < 0.8
+    assert r.content == b"second"
+    assert s.stats["hedged"] == 1
+    assert s.stats["hedge_wins"] == 1
+    s.close()
+
+
+def test_no_hedge_when_fast_or_not_asked(server):
+    server.routes["/fast"] = failing(0)
+    s = session(hedge_delay=0.5)
+    assert s.get(server.url + "/fast", hedge=True).status_code == 200
+    assert s.get(server.url + "/fast").status_code == 200
+    assert len(server.calls) == 2
+    assert s.stats["hedged"] == 0
+
+
+def test_hedge_survives_a_failed_duplicate(server):
+    count = [0]
+    lock = threading.Lock()
+
+    def route(handler):
+        with lock:
+            count[0] += 1
+            first = count[0] == 1
+        if first:
+            time.sleep(0.3)
+            handler.reply(200, b"first")
+        else:
+            # drop the connection without answering
+            handler.close_connection = True
+            handler.wfile.flush()
+            handler.connection.close()
+
+    server.routes["/odd"] = route
+    s = session(hedge_delay=0.05, retries=0)
+    assert s.get(server.url + "/odd", hedge=True).content == b"first"
+    s.close()
+
+
+def test_timeouts_per_host(server):
+    def route(handler):
+        time.sleep(0.5)
+        handler.reply()
+
+    server.routes["/slow"] = route
+    host = server.url.split("//")[1]
+    s = session(retries=0, hosts=["%s=2,0.1" % host])
+    with pytest.raises(requests.exceptions.Timeout):
+        s.get(server.url + "/slow")